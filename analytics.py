@@ -0,0 +1,166 @@
+import numpy as np
+
+
+# границы столбцов: движок принимает любые целые, в двоичном формате курс хранится как int32
+ID_RANGE = np.iinfo(np.int64)
+COURSE_RANGE = np.iinfo(np.int32)
+
+
+def _in_range(value, bounds):
+    # целое, которое не лезет в столбец, - как битая запись (иначе numpy бросит OverflowError на весь снимок)
+    if not bounds.min <= value <= bounds.max:
+        raise OverflowError(f"{value} не помещается в {bounds.dtype}")
+    return value
+
+
+# Столбцовый снимок базы для отчётов: вместо словаря на каждую запись - по массиву NumPy
+# на поле (id, факультет, курс, средний балл), факультет закодирован номером в словаре
+# faculties. Снимок строится один раз, а refresh() подтягивает только записи, изменённые
+# с прошлого раза (по StudentStorage.changes_since). Агрегаты считаются векторно.
+class ColumnarSnapshot:
+
+    def __init__(self, storage, chunk_size=100000):
+        self.storage = storage
+        self.chunk_size = chunk_size # по сколько записей переводим в массивы при полной сборке
+        self.faculties = [] # код -> название факультета
+        self._faculty_codes = {} # название -> код
+        self._rows = {} # id записи -> номер строки в массивах
+        self._mark = None
+        self._clear_columns()
+
+    def _clear_columns(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.faculty = np.empty(0, dtype=np.int32)
+        self.course = np.empty(0, dtype=np.int32)
+        self.gpa = np.empty(0, dtype=np.float64)
+        self.alive = np.empty(0, dtype=bool) # False - запись удалена после сборки снимка
+
+    def _faculty_code(self, name):
+        code = self._faculty_codes.get(name)
+        if code is None:
+            code = self._faculty_codes[name] = len(self.faculties)
+            self.faculties.append(name)
+        return code
+
+    def refresh(self):
+        mark, changed = self.storage.changes_since(self._mark)
+        if changed is None:
+            self._build()
+        elif changed:
+            self._apply(changed)
+        self._mark = mark
+        return self
+
+    def _build(self):
+        self.faculties = []
+        self._faculty_codes = {}
+        self._rows = {}
+        self._clear_columns()
+        chunk = []
+        for record in self.storage.scan():
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                self._append_rows(chunk)
+                chunk = []
+        self._append_rows(chunk)
+
+    def _append_rows(self, records):
+        rows = []
+        for record in records:
+            try:
+                rows.append((_in_range(int(record["id"]), ID_RANGE), self._faculty_code(str(record["faculty"])),
+                             _in_range(int(record["course"]), COURSE_RANGE), float(record["gpa"])))
+            except (KeyError, TypeError, ValueError, OverflowError):
+                continue # битая запись в отчёты не попадает
+        if not rows:
+            return
+        start = len(self.ids)
+        ids, faculty, course, gpa = zip(*rows)
+        self.ids = np.concatenate([self.ids, np.array(ids, dtype=np.int64)])
+        self.faculty = np.concatenate([self.faculty, np.array(faculty, dtype=np.int32)])
+        self.course = np.concatenate([self.course, np.array(course, dtype=np.int32)])
+        self.gpa = np.concatenate([self.gpa, np.array(gpa, dtype=np.float64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+        for row, record_id in enumerate(ids, start=start):
+            self._rows[str(record_id)] = row
+
+    def _apply(self, changed):
+        # изменённые записи правим на месте, удалённые помечаем, новые дописываем в конец
+        records = self.storage.get_many(changed)
+        appended = []
+        for record_id in changed:
+            row = self._rows.get(record_id)
+            record = records.get(record_id)
+            if record is None:
+                if row is not None:
+                    self.alive[row] = False
+                continue
+            if row is None:
+                appended.append(record)
+                continue
+            try:
+                self.faculty[row] = self._faculty_code(str(record["faculty"]))
+                self.course[row] = _in_range(int(record["course"]), COURSE_RANGE)
+                self.gpa[row] = float(record["gpa"])
+                self.alive[row] = True
+            except (KeyError, TypeError, ValueError, OverflowError):
+                self.alive[row] = False
+        self._append_rows(appended)
+
+    # --- запросы ---
+
+    def mask(self, faculty=None, course=None, gpa_min=None, gpa_max=None):
+        # булева маска живых строк, подходящих под условия
+        mask = self.alive.copy()
+        if faculty is not None:
+            code = self._faculty_codes.get(faculty)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= self.faculty == code
+        if course is not None:
+            mask &= self.course == int(course)
+        if gpa_min is not None:
+            mask &= self.gpa >= float(gpa_min)
+        if gpa_max is not None:
+            mask &= self.gpa <= float(gpa_max)
+        return mask
+
+    def filter_ids(self, **conditions):
+        return self.ids[self.mask(**conditions)]
+
+    def count(self, **conditions):
+        return int(self.mask(**conditions).sum())
+
+    def mean_gpa_by_faculty(self, **conditions):
+        mask = self.mask(**conditions)
+        codes = self.faculty[mask]
+        counts = np.bincount(codes, minlength=len(self.faculties))
+        sums = np.bincount(codes, weights=self.gpa[mask], minlength=len(self.faculties))
+        return {self.faculties[code]: float(sums[code] / counts[code]) for code in np.flatnonzero(counts)}
+
+    def mean_gpa_by_course(self, **conditions):
+        mask = self.mask(**conditions)
+        courses, inverse, counts = np.unique(self.course[mask], return_inverse=True, return_counts=True)
+        sums = np.bincount(inverse, weights=self.gpa[mask], minlength=len(courses))
+        return {int(course): float(sums[i] / counts[i]) for i, course in enumerate(courses)}
+
+    def course_distribution(self, **conditions):
+        courses, counts = np.unique(self.course[self.mask(**conditions)], return_counts=True)
+        return {int(course): int(count) for course, count in zip(courses, counts)}
+
+    def gpa_percentiles(self, percentiles=(25, 50, 75, 90), **conditions):
+        gpa = self.gpa[self.mask(**conditions)]
+        if not len(gpa):
+            return {}
+        return dict(zip(percentiles, np.percentile(gpa, percentiles).tolist()))
+
+    def to_dataframe(self):
+        # для произвольных group-by; факультет - категориальный столбец, названия не размножаются по строкам
+        import pandas as pd
+        alive = self.alive
+        return pd.DataFrame({
+            "id": self.ids[alive],
+            "faculty": pd.Categorical.from_codes(self.faculty[alive], categories=self.faculties),
+            "course": self.course[alive],
+            "gpa": self.gpa[alive],
+        })
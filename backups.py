@@ -0,0 +1,241 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+import zlib
+
+
+# Нумерованные бэкапы базы в папке <имя базы>_backups рядом с ней.
+# Первый бэкап полный, следующие - инкрементальные: в них только байты, дописанные
+# в файл базы после предыдущего бэкапа. Если старая часть файла с тех пор менялась
+# (сжатие, правка записи на месте), снова делается полный бэкап: что и откуда переписано,
+# знает движок (rewritten_from), сохранённую часть файла заново не читаем.
+# Файлы копируются кусками по CHUNK_SIZE (по желанию со сжатием gzip), у каждой части
+# есть контрольная сумма sha256 в manifest.json.
+# Вместе с данными сохраняется индекс, поэтому при восстановлении файл базы заново
+# не сканируется. Индекс идёт такой же цепочкой: снимок (.index) и вторичные индексы (.fields)
+# меняются только в контрольной точке, и если её с прошлого бэкапа не было, в бэкап
+# попадает лишь дописанная часть журнала (.index.log).
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST = "manifest.json"
+COMPRESS_LEVEL = 6 # уровень 9 (по умолчанию у gzip) сжимает на ~15% лучше, но в разы медленнее
+INDEX_SUFFIXES = (".index", ".index.log", ".fields") # снимок индекса, его журнал и вторичные индексы
+
+
+def backup_dir(db_file):
+    return os.path.splitext(db_file)[0] + "_backups"
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"backups": []}
+
+
+def _save_manifest(directory, manifest):
+    manifest_file = os.path.join(directory, MANIFEST)
+    with open(manifest_file + ".temp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(manifest_file + ".temp", manifest_file)
+
+
+def last_backup(db_file):
+    backups = load_manifest(backup_dir(db_file))["backups"]
+    return backups[-1] if backups else None
+
+
+def _open_part(path, mode, compressed):
+    if not compressed:
+        return open(path, mode)
+    return gzip.open(path, mode, compresslevel=COMPRESS_LEVEL)
+
+
+def _copy_range(source, target, start, end, *hashes, progress=None):
+    # копируем байты [start, end) кусками, по дороге обновляя контрольные суммы;
+    # progress получает (до какого байта скопировано, end)
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        if progress is not None:
+            progress(end - remaining, end)
+        chunk = source.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        target.write(chunk)
+        for part_hash in hashes:
+            part_hash.update(chunk)
+        remaining -= len(chunk)
+
+
+def _remove_parts(directory, number):
+    # убираем недописанные файлы бэкапа (ошибка или отмена), чтобы номер можно было занять заново
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith(f"{number:04d}."):
+            os.remove(os.path.join(directory, name))
+
+
+def create_backup(db_file, compress=True, full=False, progress=None, rewritten_from=0, checkpoint=None, log_end=None):
+    # rewritten_from - наименьшее смещение, с которого файл базы переписывался на месте после
+    # прошлого бэкапа (None - только дописывался); по умолчанию 0 - неизвестно, бэкап будет полным.
+    # checkpoint - номер контрольной точки индекса, log_end - до какого байта журнал индекса
+    # соответствует файлу базы; без них индекс копируется целиком
+    try:
+        return _create_backup(db_file, compress, full, progress, rewritten_from, checkpoint, log_end)
+    except Exception:
+        directory = backup_dir(db_file)
+        manifest = load_manifest(directory)
+        number = manifest["backups"][-1]["number"] + 1 if manifest["backups"] else 1
+        _remove_parts(directory, number)
+        raise
+
+
+def _create_backup(db_file, compress, full, progress, rewritten_from, checkpoint, log_end):
+    directory = backup_dir(db_file)
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    last = manifest["backups"][-1] if manifest["backups"] else None
+    number = last["number"] + 1 if last else 1
+    suffix = ".gz" if compress else ""
+    with open(db_file, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        if last is not None and not full and last["end"] <= size \
+                and (rewritten_from is None or rewritten_from >= last["end"]):
+            start, parent = last["end"], last["number"]
+        else: # уже сохранённая часть файла изменилась (или бэкапов ещё нет) - нужен полный бэкап
+            start, parent = 0, None
+        part = f"{number:04d}.part{suffix}"
+        part_hash = hashlib.sha256()
+        with _open_part(os.path.join(directory, part), 'wb', compress) as target:
+            _copy_range(source, target, start, size, part_hash, progress=progress)
+    # контрольной точки с прошлого бэкапа не было - снимок и вторичные индексы уже есть в цепочке
+    index_chained = parent is not None and checkpoint is not None and last.get("checkpoint") == checkpoint \
+        and last.get("log_end") is not None and last["log_end"] <= log_end
+    entry = {
+        "number": number,
+        "type": "full" if parent is None else "incremental",
+        "parent": parent,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "compressed": compress,
+        "part": part,
+        "start": start,
+        "end": size,
+        "sha256": part_hash.hexdigest(),
+        "rewritten_from": rewritten_from,
+        "index_type": "incremental" if index_chained else "full",
+        "checkpoint": checkpoint,
+        "log_end": log_end,
+        "index": {},
+    }
+    for index_suffix in INDEX_SUFFIXES:
+        index_file = db_file + index_suffix
+        if (index_chained and index_suffix != ".index.log") or not os.path.exists(index_file):
+            continue
+        index_part = f"{number:04d}{index_suffix}{suffix}"
+        index_hash = hashlib.sha256()
+        with open(index_file, 'rb') as source, _open_part(os.path.join(directory, index_part), 'wb', compress) as target:
+            index_start, index_end = 0, os.fstat(source.fileno()).st_size
+            if index_suffix == ".index.log" and log_end is not None:
+                # за log_end в журнале может быть только оборванная при сбое строка
+                index_start, index_end = last["log_end"] if index_chained else 0, log_end
+            _copy_range(source, target, index_start, index_end, index_hash)
+        entry["index"][index_suffix] = {"part": index_part, "sha256": index_hash.hexdigest(),
+                                        "start": index_start, "end": index_end}
+    manifest["backups"].append(entry)
+    _save_manifest(directory, manifest)
+    return entry
+
+
+def _restore_part(directory, part, compressed, target, expected_sha256, *hashes, progress=None, total=None):
+    part_hash = hashlib.sha256()
+    try:
+        with _open_part(os.path.join(directory, part), 'rb', compressed) as source:
+            while True:
+                if progress is not None:
+                    progress(target.tell(), total)
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+                part_hash.update(chunk)
+                for other_hash in hashes:
+                    other_hash.update(chunk)
+    except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+        raise ValueError(f"Часть бэкапа повреждена: {part} ({e})")
+    if part_hash.hexdigest() != expected_sha256:
+        raise ValueError(f"Контрольная сумма не сошлась: {part}")
+
+
+def restore_backup(db_file, directory, number=None, progress=None):
+    # восстанавливаем бэкап number (по умолчанию последний): полный + цепочка инкрементов до него
+    manifest = load_manifest(directory)
+    entries = {entry["number"]: entry for entry in manifest["backups"]}
+    if not entries:
+        raise ValueError(f"В {directory} нет бэкапов")
+    if number is None:
+        number = manifest["backups"][-1]["number"]
+    if number not in entries:
+        raise ValueError(f"Нет бэкапа номер {number}")
+    chain = []
+    entry = entries[number]
+    while entry is not None:
+        chain.append(entry)
+        entry = entries.get(entry["parent"]) if entry["parent"] is not None else None
+    chain.reverse()
+    if chain[0]["type"] != "full":
+        raise ValueError(f"Цепочка бэкапа {number} не начинается с полного бэкапа")
+    target_entry = chain[-1]
+    # собираем всё во временные файлы и подменяем базу только после проверки всех сумм
+    try:
+        prefix_hash = hashlib.sha256()
+        with open(db_file + ".restore", 'wb') as target:
+            for entry in chain:
+                if entry["start"] != target.tell():
+                    raise ValueError(f"Части бэкапа {number} не стыкуются: {entry['part']}")
+                _restore_part(directory, entry["part"], entry["compressed"], target, entry["sha256"], prefix_hash,
+                              progress=progress, total=target_entry["end"])
+            if target.tell() != target_entry["end"]:
+                raise ValueError(f"Размер восстановленной базы не сошёлся (бэкап {number})")
+        # у бэкапов старой версии есть ещё сумма всего файла
+        if "prefix_sha256" in target_entry and prefix_hash.hexdigest() != target_entry["prefix_sha256"]:
+            raise ValueError(f"Контрольная сумма восстановленной базы не сошлась (бэкап {number})")
+        # снимок и вторичные индексы - из последнего бэкапа цепочки, где индекс сохранён целиком,
+        # журнал - его часть оттуда плюс части из следующих бэкапов
+        index_chain = []
+        for entry in reversed(chain):
+            index_chain.append(entry)
+            if entry.get("index_type") != "incremental": # у бэкапов старой версии индекс всегда целиком
+                break
+        index_chain.reverse()
+        restored = set()
+        for index_suffix, index_entry in index_chain[0]["index"].items():
+            if index_suffix != ".index.log":
+                with open(db_file + index_suffix + ".restore", 'wb') as target:
+                    _restore_part(directory, index_entry["part"], index_chain[0]["compressed"], target,
+                                  index_entry["sha256"])
+                restored.add(index_suffix)
+        log_parts = [(entry, entry["index"][".index.log"]) for entry in index_chain if ".index.log" in entry["index"]]
+        if log_parts:
+            with open(db_file + ".index.log.restore", 'wb') as target:
+                for entry, index_entry in log_parts:
+                    if index_entry.get("start", 0) != target.tell():
+                        raise ValueError(f"Части журнала индекса бэкапа {number} не стыкуются: {entry['number']}")
+                    _restore_part(directory, index_entry["part"], entry["compressed"], target, index_entry["sha256"])
+            restored.add(".index.log")
+    except Exception:
+        for path in [db_file] + [db_file + index_suffix for index_suffix in INDEX_SUFFIXES]:
+            if os.path.exists(path + ".restore"):
+                os.remove(path + ".restore")
+        raise
+    os.replace(db_file + ".restore", db_file)
+    for index_suffix in INDEX_SUFFIXES:
+        if index_suffix in restored:
+            os.replace(db_file + index_suffix + ".restore", db_file + index_suffix)
+        elif os.path.exists(db_file + index_suffix):
+            os.remove(db_file + index_suffix)
+    return target_entry
@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import formats
+import metrics
+from storage import StudentStorage, encode_json, make_record
+
+
+# Замеры движка без окна на синтетических базах заданного размера (10^3 ... 10^7 записей).
+# Для каждой операции: сколько раз выполнили, пропускная способность, задержка p50/p99
+# и пиковая память одного вызова (tracemalloc, отдельным прогоном - он сильно замедляет работу).
+# По задержкам на разных размерах считается показатель роста: ~0 - время не зависит
+# от размера базы (O(1)), ~1 - растёт линейно (O(n)).
+# Вместе с замерами сохраняются счётчики движка (storage.metrics), а с --profile
+# печатается разбивка по функциям (cProfile).
+# Результаты пишутся в JSON; с --baseline сравниваются с сохранённым прогоном, и если
+# какая-то операция стала медленнее больше чем на --tolerance, скрипт падает с кодом 1.
+#
+#   python benchmark.py --sizes 1e3,1e4,1e5 --out results.json
+#   python benchmark.py --sizes 1e3,1e4,1e5 --baseline results.json
+
+PAGE_SIZE = 100 # как в окне: refresh_table грузит одну страницу
+
+FACULTIES = ["ФИТ", "ФМ", "Физический", "Химический", "Экономический", "Юридический", "Исторический", "Филологический"]
+NAMES = ["Александр", "Мария", "Иван", "Анна", "Дмитрий", "Елена", "Сергей", "Ольга", "Алексей", "Татьяна",
+         "Андрей", "Наталья", "Михаил", "Екатерина", "Николай", "Юлия", "Пётр", "Ирина", "Фёдор", "Светлана"]
+
+
+def synthetic_record(rng, record_id):
+    return make_record(record_id, f"{rng.choice(NAMES)} {record_id % 1000}", rng.choice(FACULTIES),
+                       rng.randint(1, 6), round(rng.uniform(2.0, 5.0), 2))
+
+
+def misspell(rng, word):
+    # опечатка для нечёткого поиска: одна буква заменена соседней по алфавиту
+    i = rng.randrange(len(word))
+    return word[:i] + chr(ord(word[i]) + 1) + word[i + 1:]
+
+
+def generate_database(db_file, size, seed=1):
+    # файл базы пишем напрямую, потоком: через put_many 10^7 записей шли бы слишком долго
+    rng = random.Random(seed)
+    with open(db_file, 'w', encoding='utf-8') as f:
+        for record_id in range(size):
+            f.write(encode_json(synthetic_record(rng, record_id)) + '\n')
+
+
+def percentile(sorted_values, q):
+    # по ближайшему рангу
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def peak_memory(call):
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(call, samples):
+    # call(i) выполняется samples раз; последний, лишний вызов - под tracemalloc
+    latencies = []
+    for i in range(samples):
+        start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - start)
+    peak = peak_memory(lambda: call(samples))
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "count": samples,
+        "total_s": total,
+        "throughput": samples / total if total else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def run_size(size, ops, repeat, seed, workdir, record_format="jsonl"):
+    db_file = os.path.join(workdir, f"bench_{size}.json")
+    generate_database(db_file, size, seed)
+    if record_format != "jsonl":
+        formats.convert_file(db_file, db_file, record_format)
+    rng = random.Random(seed + 1)
+    storage = StudentStorage(compact_ratio=None) # сжатие в фоне исказило бы замеры
+    results = {}
+    search_samples = max(1, min(ops, 20))
+
+    def open_rebuild(i):
+        # без индекса на диске - открытие с полным проходом по файлу
+        for suffix in (".index", ".index.log", ".fields"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        storage.open(db_file)
+
+    results["open_rebuild"] = measure(open_rebuild, repeat)
+    results["open"] = measure(lambda i: storage.open(db_file), repeat) # индекс сходится с файлом - берётся как есть
+    results["get_by_id"] = measure(lambda i: storage.get(rng.randrange(size)), ops)
+    results["find_faculty"] = measure(lambda i: storage.find("faculty", rng.choice(FACULTIES)), search_samples)
+    results["find_name"] = measure(lambda i: storage.find("name", f"{rng.choice(NAMES)} {rng.randrange(1000)}"),
+                                   search_samples)
+    results["search_name_prefix"] = measure(lambda i: storage.search("name", rng.choice(NAMES)[:4], "prefix"),
+                                            search_samples)
+    results["search_name_fuzzy"] = measure(lambda i: storage.search("name", misspell(rng, rng.choice(NAMES))),
+                                           search_samples)
+    results["find_range_gpa"] = measure(lambda i: storage.find_range("gpa", 4.9, 5.0), search_samples)
+    results["table_page"] = measure(lambda i: storage.page(rng.randrange(max(1, size - PAGE_SIZE)), PAGE_SIZE), ops)
+
+    next_id = [size]
+
+    def add(i):
+        storage.put(synthetic_record(rng, next_id[0]))
+        next_id[0] += 1
+
+    results["add"] = measure(add, ops)
+    results["edit"] = measure(lambda i: storage.put(synthetic_record(rng, rng.randrange(size))), ops)
+    deleted = rng.sample(range(size), min(size, ops + 1))
+    results["delete"] = measure(lambda i: storage.delete(deleted[i]), min(size, ops + 1) - 1)
+
+    results["backup_full"] = measure(lambda i: storage.backup(full=True), repeat)
+    for i in range(ops):
+        add(i)
+    results["backup_incremental"] = measure(lambda i: storage.backup(), 1)
+    directory = os.path.splitext(db_file)[0] + "_backups"
+    results["restore"] = measure(lambda i: storage.restore(directory), repeat)
+    storage.close()
+    return results, storage.metrics.snapshot()["counters"]
+
+
+def growth(runs):
+    # показатель роста задержки p50 между самым маленьким и самым большим размером (в log-log)
+    sizes = sorted(runs, key=int)
+    if len(sizes) < 2:
+        return {}
+    small, large = runs[sizes[0]], runs[sizes[-1]]
+    exponents = {}
+    for operation, stats in large.items():
+        before = small.get(operation, {}).get("p50_ms")
+        if before and stats["p50_ms"]:
+            exponents[operation] = math.log(stats["p50_ms"] / before) / math.log(int(sizes[-1]) / int(sizes[0]))
+    return exponents
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, operations in results["runs"].items():
+        for operation, stats in operations.items():
+            before = baseline.get("runs", {}).get(size, {}).get(operation)
+            if before is None:
+                continue
+            if stats["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+                regressions.append(f"{operation} на {size} записях: p50 {before['p50_ms']:.3f} -> "
+                                   f"{stats['p50_ms']:.3f} мс")
+    return regressions
+
+
+def print_report(results):
+    for size, operations in results["runs"].items():
+        print(f"\n=== {size} записей ===")
+        print(f"{'операция':<20}{'раз':>8}{'оп/с':>12}{'p50, мс':>12}{'p99, мс':>12}{'память, КиБ':>14}")
+        for operation, stats in operations.items():
+            throughput = f"{stats['throughput']:.1f}" if stats["throughput"] else "-"
+            print(f"{operation:<20}{stats['count']:>8}{throughput:>12}{stats['p50_ms']:>12.3f}"
+                  f"{stats['p99_ms']:>12.3f}{stats['peak_kib']:>14.1f}")
+    if results["growth"]:
+        print("\nПоказатель роста p50 (0 - O(1), 1 - O(n)):")
+        for operation, exponent in results["growth"].items():
+            print(f"  {operation:<20}{exponent:>6.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры движка базы студентов на синтетических данных")
+    parser.add_argument("--sizes", default="1e3,1e4,1e5", help="размеры баз через запятую (можно 1e6)")
+    parser.add_argument("--ops", type=int, default=1000, help="сколько раз повторять быстрые операции")
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз повторять открытие, бэкап, восстановление")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--baseline", help="сохранённые результаты для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="допустимое замедление p50 (0.5 = на 50%%)")
+    parser.add_argument("--workdir", help="папка для временных баз (по умолчанию - временная)")
+    parser.add_argument("--profile", action="store_true", help="напечатать разбивку времени по функциям")
+    parser.add_argument("--format", default="jsonl", choices=sorted(formats.FORMATS), help="формат файла базы")
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="students_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ops": args.ops,
+        "repeat": args.repeat,
+        "format": args.format,
+        "runs": {},
+        "counters": {},
+    }
+    try:
+        for size in sizes:
+            print(f"Размер {size}...", file=sys.stderr)
+            with metrics.profile() if args.profile else contextlib.nullcontext():
+                results["runs"][str(size)], results["counters"][str(size)] = run_size(size, args.ops, args.repeat,
+                                                                                      args.seed, workdir, args.format)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results["growth"] = growth(results["runs"])
+    print_report(results)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"\nРезультаты сохранены: {args.out}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nРЕГРЕССИЯ производительности:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print(f"\nРегрессий относительно {args.baseline} нет.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import csv
+import json
+
+from storage import encode_json, make_record, report_progress
+
+
+# Массовая загрузка и выгрузка записей (CSV, JSON lines, pandas DataFrame).
+# Вход читается потоком, каждая строка проверяется как в окне добавления записи,
+# повторяющиеся ID (в базе или во входных данных) отклоняются.
+# Записи дописываются в базу подряд, а индекс сохраняется один раз в конце.
+
+FIELDS = ("id", "name", "faculty", "course", "gpa")
+
+# заголовки столбцов, которые понимаем при импорте (как в таблице окна и как в JSON)
+COLUMNS = {
+    "ID": "id",
+    "Имя": "name",
+    "Факультет": "faculty",
+    "Курс": "course",
+    "Средний балл": "gpa",
+}
+
+MAX_ERRORS = 100 # сколько ошибок запоминать подробно, остальные только считаем
+
+
+def _reject(result, line_number, error):
+    result["rejected"] += 1
+    if len(result["errors"]) < MAX_ERRORS:
+        result["errors"].append((line_number, error))
+
+
+def _validated(storage, rows, result, progress=None):
+    # rows - пары (номер строки, словарь); отдаём только годные записи с новыми ID
+    seen = set()
+    for done, (line_number, row) in enumerate(rows):
+        report_progress(progress, done)
+        try:
+            row = {COLUMNS.get(key, key): value for key, value in row.items()}
+            record = make_record(row["id"], row["name"], row["faculty"], row["course"], row["gpa"])
+        except KeyError as e:
+            _reject(result, line_number, f"нет поля {e}")
+            continue
+        except (TypeError, ValueError) as e:
+            _reject(result, line_number, f"неверное значение: {e}")
+            continue
+        record_id = str(record["id"])
+        if record_id in storage.index or record_id in seen: # индекс уже загружен в put_many
+            _reject(result, line_number, f"такой ID уже есть: {record_id}")
+            continue
+        seen.add(record_id)
+        result["imported"] += 1
+        yield record
+
+
+def import_rows(storage, rows, progress=None):
+    # при отмене (исключение из progress) уже загруженные записи остаются в базе
+    result = {"imported": 0, "rejected": 0, "errors": []}
+    storage.put_many(_validated(storage, rows, result, progress), journal=False)
+    return result
+
+
+def _csv_rows(file_path):
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2): # первая строка - заголовок
+            yield line_number, row
+
+
+def _jsonl_rows(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = {"id": None} # пусть отклонится как неверное значение
+            yield line_number, row if isinstance(row, dict) else {"id": None}
+
+
+def _dataframe_rows(df, chunk_size):
+    # DataFrame разбираем кусками, чтобы не делать словарь из всей таблицы сразу
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        for line_number, row in enumerate(chunk.to_dict('records'), start=start + 1):
+            yield line_number, row
+
+
+def import_csv(storage, file_path, progress=None):
+    return import_rows(storage, _csv_rows(file_path), progress)
+
+
+def import_jsonl(storage, file_path, progress=None):
+    return import_rows(storage, _jsonl_rows(file_path), progress)
+
+
+def import_dataframe(storage, df, chunk_size=10000, progress=None):
+    return import_rows(storage, _dataframe_rows(df, chunk_size), progress)
+
+
+def import_file(storage, file_path, progress=None):
+    if file_path.lower().endswith(".csv"):
+        return import_csv(storage, file_path, progress)
+    return import_jsonl(storage, file_path, progress)
+
+
+def export_csv(storage, file_path, progress=None):
+    count = 0
+    with open(file_path, 'w', encoding='utf-8-sig', newline='') as f: # utf-8-sig - чтобы Excel понял кириллицу
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in storage.scan(progress):
+            writer.writerow(record)
+            count += 1
+    return count
+
+
+def export_jsonl(storage, file_path, progress=None):
+    count = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for record in storage.scan(progress):
+            f.write(encode_json(record) + '\n')
+            count += 1
+    return count
+
+
+def export_file(storage, file_path, progress=None):
+    if file_path.lower().endswith(".csv"):
+        return export_csv(storage, file_path, progress)
+    return export_jsonl(storage, file_path, progress)
+
+
+def to_dataframe(storage):
+    import pandas as pd # нужен только здесь, сам движок от pandas не зависит
+    return pd.DataFrame.from_records(storage.scan(), columns=FIELDS)
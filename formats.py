@@ -0,0 +1,345 @@
+import json
+import os
+import struct
+
+from metrics import log
+
+
+# Форматы файла базы. StudentStorage работает с записями через объект формата:
+# как закодировать запись и надгробие, где кончается запись по смещению, как её разобрать,
+# как перезаписать запись на месте и как пройти файл подряд (перестройка индекса, сжатие).
+#
+# JSON lines (по умолчанию) - одна запись JSON на строку, файл можно читать глазами.
+#
+# Двоичный - после заголовка (HEADER_SIZE байт: MAGIC и таблица факультетов) идут кадры
+# "длина кадра (4 байта) + вид (1 байт) + тело":
+#   RECORD  - id (8), курс (4), средний балл (8), код факультета (1), длина имени (2), имя в UTF-8;
+#             факультет хранится кодом из таблицы в заголовке, а если таблица полна - строкой (INLINE);
+#   DELETED - надгробие, id (8);
+#   JSON    - запись или надгробие, которые не ложатся в RECORD (другие поля или типы), - как JSON;
+#   PAD     - пустое место после перезаписи на месте более короткой версией.
+# Имена ключей не повторяются в каждой записи и числа не разбираются из текста, поэтому
+# файл меньше, а чтение и проход по файлу быстрее. В отличие от JSON lines, после
+# испорченной длины кадра остаток файла не разобрать - читать дальше не с чего.
+
+MAGIC = b"SDBIN001"
+HEADER_SIZE = 4096
+SCAN_CHUNK = 1024 * 1024 # проход по двоичному файлу - такими кусками, а не по два read на кадр
+
+FRAME = struct.Struct("<IB") # длина всего кадра, вид
+RECORD = struct.Struct("<qidBH") # id, курс, средний балл, код факультета, длина имени
+RECORD_FRAME = struct.Struct("<IBqidBH") # заголовок кадра и RECORD одним вызовом - для чтения
+DELETED = struct.Struct("<q")
+COUNT = struct.Struct("<H")
+LENGTH = struct.Struct("<H")
+
+PAD, RECORD_KIND, DELETED_KIND, JSON_KIND = 0, 1, 2, 3
+INLINE = 255 # код факультета "строка лежит прямо в записи"
+
+RECORD_FIELDS = {"id": int, "name": str, "faculty": str, "course": int, "gpa": float}
+
+# один кодировщик на весь модуль: json.dumps(..., ensure_ascii=False) создаёт новый на каждый вызов
+encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class JsonLinesFormat:
+    name = "jsonl"
+    header_size = 0
+    separator = 1 # перевод строки после записи (в срез _read_line не входит)
+
+    def __init__(self):
+        self.header_changed = False # заголовка нет
+        self.path = None
+
+    def read_header(self, path):
+        self.path = path
+
+    def header_bytes(self):
+        return b''
+
+    def encode(self, record):
+        return (encode_json(record) + '\n').encode('utf-8')
+
+    def tombstone(self, record_id):
+        return (json.dumps({"id": record_id, "deleted": True}) + '\n').encode('utf-8')
+
+    def frame_end(self, buffer, position):
+        end = buffer.find(b'\n', position)
+        return len(buffer) if end == -1 else end
+
+    def read_frame(self, f):
+        # как срез отображения до frame_end - без перевода строки
+        line = f.readline()
+        return line[:-1] if line.endswith(b'\n') else line
+
+    def frames(self, f):
+        return f # строки файла от текущей позиции
+
+    def decode(self, frame):
+        # запись, надгробие ({"deleted": true}) или None для пустой строки; ValueError - если не разобрать
+        line = str(frame, 'utf-8', 'ignore').rstrip('\r\n')
+        return json.loads(line) if line else None
+
+    def torn(self, frame):
+        # строка не дописана (сбой посреди дописывания) - бывает только последней в файле
+        return not bytes(frame).endswith(b'\n')
+
+    def sealed(self, frame):
+        # оборванная строка, закрытая переводом строки: следующая запись начнётся с новой строки,
+        # а не склеится с обрывком
+        return bytes(frame) + b'\n'
+
+    def live_length(self, frame):
+        # сколько байт строки занято записью: пробелы после перезаписи на месте - мёртвые
+        return len(bytes(frame).rstrip()) + 1
+
+    def trimmed(self, frame):
+        # строка для переписанного файла (сжатие) - без пробелов-заполнителей
+        return bytes(frame).rstrip() + b'\n'
+
+    def rewrite(self, data, length):
+        # data (новая версия) на месте старой длиной length; None - не помещается
+        if len(data) > length:
+            return None
+        return data[:-1] + b' ' * (length - len(data)) + b'\n'
+
+
+class BinaryFormat:
+    name = "binary"
+    header_size = HEADER_SIZE
+    separator = 0
+
+    def __init__(self):
+        self.faculties = [] # код -> название
+        self.codes = {} # название -> код
+        self.header_changed = False # в таблицу добавлен факультет, заголовок файла надо переписать
+        self.path = None
+
+    def read_header(self, path):
+        # таблицу факультетов перечитываем, если её мог дополнить другой процесс
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+        except FileNotFoundError:
+            return
+        if not header.startswith(MAGIC):
+            raise ValueError(f"{path}: не двоичная база")
+        faculties = []
+        position = len(MAGIC) + COUNT.size
+        for _ in range(COUNT.unpack_from(header, len(MAGIC))[0]):
+            length = header[position]
+            faculties.append(header[position + 1:position + 1 + length].decode('utf-8'))
+            position += 1 + length
+        self.faculties = faculties
+        self.codes = {faculty: code for code, faculty in enumerate(faculties)}
+        self.header_changed = False
+
+    def header_bytes(self):
+        header = bytearray(MAGIC + COUNT.pack(len(self.faculties)))
+        for faculty in self.faculties:
+            faculty_bytes = faculty.encode('utf-8')
+            header += bytes([len(faculty_bytes)]) + faculty_bytes
+        return bytes(header) + b'\0' * (HEADER_SIZE - len(header))
+
+    def _faculty_code(self, faculty):
+        code = self.codes.get(faculty)
+        if code is not None:
+            return code
+        faculty_bytes = faculty.encode('utf-8')
+        used = len(MAGIC) + COUNT.size + sum(1 + len(name.encode('utf-8')) for name in self.faculties)
+        if len(self.faculties) >= INLINE or len(faculty_bytes) > 255 or used + 1 + len(faculty_bytes) > HEADER_SIZE:
+            return INLINE
+        code = self.codes[faculty] = len(self.faculties)
+        self.faculties.append(faculty)
+        self.header_changed = True
+        return code
+
+    def encode(self, record):
+        if len(record) == len(RECORD_FIELDS) and all(type(record.get(field)) is kind
+                                                     for field, kind in RECORD_FIELDS.items()):
+            name = record["name"].encode('utf-8')
+            if -2 ** 63 <= record["id"] < 2 ** 63 and -2 ** 31 <= record["course"] < 2 ** 31 and len(name) <= 0xFFFF:
+                code = self._faculty_code(record["faculty"])
+                body = RECORD.pack(record["id"], record["course"], record["gpa"], code, len(name)) + name
+                if code == INLINE:
+                    faculty = record["faculty"].encode('utf-8')
+                    if len(faculty) <= 0xFFFF:
+                        body += LENGTH.pack(len(faculty)) + faculty
+                        return FRAME.pack(FRAME.size + len(body), RECORD_KIND) + body
+                else:
+                    return FRAME.pack(FRAME.size + len(body), RECORD_KIND) + body
+        body = encode_json(record).encode('utf-8')
+        return FRAME.pack(FRAME.size + len(body), JSON_KIND) + body
+
+    def tombstone(self, record_id):
+        if type(record_id) is int and -2 ** 63 <= record_id < 2 ** 63:
+            return FRAME.pack(FRAME.size + DELETED.size, DELETED_KIND) + DELETED.pack(record_id)
+        body = json.dumps({"id": record_id, "deleted": True}).encode('utf-8')
+        return FRAME.pack(FRAME.size + len(body), JSON_KIND) + body
+
+    def frame_end(self, buffer, position):
+        try:
+            return min(len(buffer), position + FRAME.unpack_from(buffer, position)[0])
+        except struct.error: # от кадра остался обрывок меньше заголовка
+            return len(buffer)
+
+    def read_frame(self, f):
+        header = f.read(FRAME.size)
+        if len(header) < FRAME.size:
+            return header
+        return header + f.read(FRAME.unpack(header)[0] - FRAME.size)
+
+    def frames(self, f):
+        # кадры подряд от текущей позиции f; оборванный или испорченный остаток - одним куском в конце
+        buffer, position = b'', 0
+        while True:
+            length = FRAME.unpack_from(buffer, position)[0] if len(buffer) - position >= FRAME.size else None
+            if length is not None and length < FRAME.size:
+                yield buffer[position:] + f.read() # длина испорчена - дальше границ кадров не найти
+                return
+            if length is None or len(buffer) - position < length:
+                chunk = f.read(SCAN_CHUNK)
+                if not chunk:
+                    if position < len(buffer):
+                        yield buffer[position:]
+                    return
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield buffer[position:position + length]
+            position += length
+
+    def decode(self, frame):
+        if len(frame) >= RECORD_FRAME.size and frame[4] == RECORD_KIND:
+            # обычная запись с факультетом из таблицы - самый частый случай, разбираем одним unpack
+            length, kind, record_id, course, gpa, code, name_length = RECORD_FRAME.unpack_from(frame)
+            if code < len(self.faculties) and length == len(frame) == RECORD_FRAME.size + name_length:
+                return {"id": record_id, "name": str(frame[RECORD_FRAME.size:], 'utf-8'),
+                        "faculty": self.faculties[code], "course": course, "gpa": gpa}
+        try:
+            length, kind = FRAME.unpack_from(frame)
+            if length != len(frame):
+                raise ValueError(f"кадр оборван: {len(frame)} байт из {length}")
+            if kind == RECORD_KIND:
+                record_id, course, gpa, code, name_length = RECORD.unpack_from(frame, FRAME.size)
+                position = FRAME.size + RECORD.size
+                name = str(frame[position:position + name_length], 'utf-8')
+                if code == INLINE:
+                    position += name_length
+                    faculty_length = LENGTH.unpack_from(frame, position)[0]
+                    faculty = str(frame[position + LENGTH.size:position + LENGTH.size + faculty_length], 'utf-8')
+                else:
+                    faculty = self._faculty(code)
+                return {"id": record_id, "name": name, "faculty": faculty, "course": course, "gpa": gpa}
+            if kind == DELETED_KIND:
+                return {"id": DELETED.unpack_from(frame, FRAME.size)[0], "deleted": True}
+            if kind == JSON_KIND:
+                return json.loads(str(frame[FRAME.size:], 'utf-8'))
+            if kind == PAD:
+                return None
+        except struct.error as e:
+            raise ValueError(f"кадр не разобран: {e}")
+        raise ValueError(f"неизвестный вид кадра: {kind}")
+
+    def _faculty(self, code):
+        if code >= len(self.faculties) and self.path is not None:
+            self.read_header(self.path) # факультет добавил другой процесс - заголовок пишется раньше записи
+        if code >= len(self.faculties):
+            raise ValueError(f"нет факультета с кодом {code}")
+        return self.faculties[code]
+
+    def torn(self, frame):
+        # кадр короче своей длины (сбой посреди дописывания) или длина испорчена - бывает только
+        # последним в файле, frames() отдаёт такой остаток одним куском
+        return len(frame) < FRAME.size or FRAME.unpack_from(frame)[0] != len(frame)
+
+    def sealed(self, frame):
+        # оборванный остаток - в пустое место (PAD) той же длины, но не короче заголовка кадра:
+        # иначе следующий кадр считался бы продолжением обрывка
+        length = max(len(frame), FRAME.size)
+        return FRAME.pack(length, PAD) + bytes(frame[FRAME.size:length])
+
+    def live_length(self, frame):
+        return len(frame) # пустое место - отдельные кадры PAD
+
+    def trimmed(self, frame):
+        return bytes(frame)
+
+    def rewrite(self, data, length):
+        # остаток закрываем кадром PAD; если на него не хватает места (меньше заголовка кадра) - не помещается
+        rest = length - len(data)
+        if rest == 0:
+            return data
+        if rest < FRAME.size:
+            return None
+        return data + FRAME.pack(rest, PAD) + b'\0' * (rest - FRAME.size)
+
+
+FORMATS = {"jsonl": JsonLinesFormat, "binary": BinaryFormat}
+
+
+def detect(path):
+    # формат существующего файла базы по его началу; новый или пустой файл - JSON lines
+    try:
+        with open(path, 'rb') as f:
+            start = f.read(len(MAGIC))
+    except FileNotFoundError:
+        start = b''
+    if start != MAGIC:
+        return JsonLinesFormat()
+    record_format = BinaryFormat()
+    record_format.read_header(path)
+    return record_format
+
+
+def make(name, path=None):
+    # новый, ещё пустой формат name для файла path
+    if name not in FORMATS:
+        raise ValueError(f"Неизвестный формат базы: {name}")
+    record_format = FORMATS[name]()
+    record_format.path = path
+    return record_format
+
+
+def convert_file(source_file, target_file, record_format=None, progress=None):
+    # файл базы в другой формат (по умолчанию - в противоположный: JSON lines <-> двоичный) без потерь:
+    # все записи и надгробия переписываются по порядку, пустое место и испорченные записи выкидываются.
+    # Индекс у новой базы строится при первом открытии. Возвращает число переписанных записей
+    source_format = detect(source_file)
+    if record_format is None:
+        record_format = "jsonl" if source_format.name == "binary" else "binary"
+    target_format = make(record_format, target_file)
+    converted = 0
+    temp_file = target_file + ".temp"
+    try:
+        with open(source_file, 'rb') as source, open(temp_file, 'wb') as target:
+            size = os.fstat(source.fileno()).st_size
+            position = next_report = source.seek(source_format.header_size)
+            target.write(target_format.header_bytes()) # место под заголовок, таблица факультетов допишется в конце
+            for frame in source_format.frames(source):
+                if progress is not None and position >= next_report:
+                    progress(position, size)
+                    next_report += SCAN_CHUNK
+                try:
+                    record = source_format.decode(frame)
+                    if record is not None and not isinstance(record, dict):
+                        raise ValueError("это не запись")
+                except ValueError as e:
+                    log.warning("Пропускаем некорректную запись на смещении %d: %s", position, e)
+                    record = None
+                position += len(frame)
+                if record is None:
+                    continue
+                if record.get("deleted"):
+                    target.write(target_format.tombstone(record.get("id")))
+                else:
+                    target.write(target_format.encode(record))
+                converted += 1
+            target.seek(0)
+            target.write(target_format.header_bytes())
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, target_file)
+    return converted
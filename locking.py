@@ -0,0 +1,93 @@
+import contextlib
+import os
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Межпроцессная рекомендательная блокировка базы на файле <база>.lock:
+# один писатель (exclusive) или сколько угодно читателей (shared).
+# Блокировку берут только изменения базы и перечитывание индекса; сами записи читаются
+# без неё, по смещениям своего снимка индекса (см. StudentStorage).
+# Повторный вход разрешён: вложенные захваты только считаются, shared внутри exclusive
+# ничего не делает. exclusive внутри shared - ошибка: повышение блокировки не атомарно,
+# и прочитанное под shared к тому времени могло устареть.
+# На Windows (msvcrt) блокировка всегда монопольная - читатели там идут по очереди.
+# Объект не потокобезопасен: движок пользуется им только под своей монопольной блокировкой.
+class FileLock:
+
+    def __init__(self, path):
+        self.path = path # None - база не открыта, блокировать нечего
+        self._file = None
+        self._modes = [] # стек вложенных захватов: True - exclusive, False - shared
+
+    def acquire(self, exclusive=True):
+        if self.path is None:
+            return
+        if not self._modes:
+            if self._file is None:
+                self._file = open(self.path, 'a+b')
+            self._lock(exclusive)
+        elif exclusive and not self._modes[0]:
+            raise RuntimeError("Нельзя повысить блокировку базы на чтение до блокировки на запись")
+        self._modes.append(exclusive)
+
+    def release(self):
+        if self.path is None:
+            return
+        self._modes.pop()
+        if not self._modes:
+            self._unlock()
+
+    def _lock(self, exclusive):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            return
+        self._file.seek(0)
+        while True: # LK_LOCK сдаётся через 10 секунд - ждём сколько нужно сами
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        self.acquire(True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire(False)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def close(self):
+        if self._modes:
+            self._modes = []
+            self._unlock()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
@@ -0,0 +1,159 @@
+import contextlib
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+# Счётчики и таймеры движка вместо печати в консоль.
+# У каждого StudentStorage свой объект Metrics (storage.metrics):
+#   counters - сколько записей просмотрено, байт прочитано, загрузок и перестроек индекса и т.п.;
+#   timers   - по операциям: число вызовов, суммарное и наибольшее время.
+# Счётчики увеличиваются без блокировки: при параллельных чтениях отдельные приращения
+# могут потеряться, зато горячий путь (чтение записи) не замедляется.
+# Сообщения движка идут в logging (логгер "students"); подробный журнал включается
+# enable_debug_logging() или переменной окружения STUDENTS_DEBUG=1.
+# Для разбора, куда уходит время, есть trace() (каждый вызов операции с её длительностью
+# и приращениями счётчиков) и profile() (cProfile по функциям).
+
+log = logging.getLogger("students")
+
+
+def enable_debug_logging(level=logging.DEBUG, stream=None):
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(level)
+    return handler
+
+
+def configure_logging():
+    # для окна: предупреждения и сообщения о сжатии - в консоль как раньше, подробности - по STUDENTS_DEBUG
+    if os.environ.get("STUDENTS_DEBUG"):
+        enable_debug_logging()
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+
+class Metrics:
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {} # операция -> [вызовов, суммарное время, наибольшее время]
+        self._tracers = [] # списки, куда trace() собирает вызовы
+        self._lock = threading.Lock() # только для таймеров и трассировки, не для счётчиков
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_read(self, size):
+        # прочитана одна запись size байт - самый частый случай, поэтому одним вызовом
+        counters = self.counters
+        counters["records_read"] = counters.get("records_read", 0) + 1
+        counters["bytes_read"] = counters.get("bytes_read", 0) + size
+
+    def begin(self):
+        # перед операцией: копия счётчиков, если идёт трассировка (для приращений), иначе None
+        return dict(self.counters) if self._tracers else None
+
+    def record(self, name, seconds, before=None):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+            if before is not None and self._tracers:
+                delta = {key: value - before.get(key, 0) for key, value in self.counters.items()
+                         if value != before.get(key, 0)}
+                for calls in self._tracers:
+                    calls.append((name, seconds, delta))
+        log.debug("%s: %.3f мс", name, seconds * 1000)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        before = self.begin()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, before)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {name: {"calls": calls, "total_s": total, "max_s": longest}
+                           for name, (calls, total, longest) in self.timers.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timers = {}
+
+    def report(self):
+        # текстовая сводка: операции по убыванию суммарного времени, затем счётчики
+        snapshot = self.snapshot()
+        lines = [f"{'операция':<24}{'вызовов':>10}{'всего, мс':>14}{'среднее, мс':>14}{'макс, мс':>12}"]
+        for name, timer in sorted(snapshot["timers"].items(), key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{name:<24}{timer['calls']:>10}{timer['total_s'] * 1000:>14.2f}"
+                         f"{timer['total_s'] / timer['calls'] * 1000:>14.3f}{timer['max_s'] * 1000:>12.3f}")
+        lines.append("")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name:<24}{value:>14}")
+        return "\n".join(lines)
+
+    @contextlib.contextmanager
+    def trace(self, stream=None):
+        # каждый вызов операции внутри блока: (операция, секунды, приращения счётчиков);
+        # при выходе печатает разбивку в stream (если задан)
+        calls = []
+        with self._lock:
+            self._tracers.append(calls)
+        try:
+            yield calls
+        finally:
+            with self._lock:
+                self._tracers.remove(calls)
+            if stream is not None:
+                for name, seconds, delta in calls:
+                    counters = ", ".join(f"{key}={value}" for key, value in sorted(delta.items()))
+                    print(f"{name:<24}{seconds * 1000:>12.3f} мс  {counters}", file=stream)
+
+
+def timed(name):
+    # декоратор метода StudentStorage: время вызова идёт в self.metrics под именем name
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            before = metrics.begin()
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start, before)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def profile(stream=None, sort="cumulative", limit=30):
+    # разбивка по функциям (cProfile) для всего, что выполнилось внутри блока в этом потоке
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(sort).print_stats(limit)
+        print(output.getvalue(), file=stream or sys.stderr)
@@ -0,0 +1,1417 @@
+import bisect
+import contextlib
+import functools
+import itertools
+import json
+import math
+import mmap
+import os
+import threading
+import zlib
+
+import backups
+import formats
+from formats import encode_json
+from locking import FileLock
+from metrics import Metrics, log, timed
+
+
+# поля, по которым можно держать вторичные индексы (значение поля -> множество id)
+INDEXED_FIELDS = ("name", "faculty", "course", "gpa")
+
+# числовые поля с упорядоченным индексом (диапазоны, больше/меньше, лучшие K) и их типы
+RANGE_FIELDS = {"id": int, "course": int, "gpa": float}
+
+# текстовые поля с поиском по началу слова, подстроке и похожести (индекс триграмм, см. search)
+TEXT_FIELDS = ("name", "faculty")
+GRAM_SIZE = 3
+FUZZY_MIN_SCORE = 0.5 # какая доля триграмм запроса должна найтись в значении, чтобы считать его похожим
+SEARCH_MODES = ("prefix", "substring", "fuzzy")
+
+# версия файла .fields; файл другой версии не читается, вторичные индексы строятся заново
+FIELDS_VERSION = 3 # 3: nan и бесконечности не попадают в упорядоченные индексы
+
+# как часто долгие операции сообщают о ходе работы (раз в столько записей)
+PROGRESS_STEP = 10000
+
+# сколько байт в начале и в конце файла базы входит в контрольную сумму заголовка индекса
+CHECK_BYTES = 4096
+
+
+def fold_text(value):
+    # текст для сравнения без учёта регистра: casefold, а не lower (правильно для любых алфавитов),
+    # и ё = е - "Фёдоров", "ФЕДОРОВ" и "федоров" одно и то же
+    return str(value).casefold().replace("ё", "е")
+
+
+def text_grams(text):
+    # триграммы текста; пробелы по краям отмечают начало и конец слова
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def text_rank(key, query, mode, score=0.0):
+    # место значения key в выдаче search (меньше - выше) или None, если оно не подходит:
+    # значение целиком, его начало, начало слова в нём, подстрока, похожее (score - доля
+    # триграмм запроса, найденных в значении); при равенстве выше более короткие значения
+    if key == query:
+        tier = 0
+    elif key.startswith(query):
+        tier = 1
+    elif f" {query}" in f" {key}":
+        tier = 2
+    elif mode != "prefix" and query in key:
+        tier = 3
+    elif mode == "fuzzy" and score >= FUZZY_MIN_SCORE:
+        return (4, -score, len(key), key)
+    else:
+        return None
+    return (tier, 0, len(key), key)
+
+
+def field_key(field, value):
+    # ключ значения во вторичном индексе; имя и факультет ищутся без учёта регистра и ё/е
+    if field in TEXT_FIELDS:
+        return fold_text(value)
+    if field == "course":
+        return str(int(value))
+    if field == "gpa":
+        return repr(float(value))
+    return str(value)
+
+
+def range_value(field, value):
+    # значение числового поля в упорядоченном индексе и при сравнениях; nan ни с чем не сравнивается
+    # и сломал бы порядок (bisect), поэтому такие значения, как и бесконечности, в диапазоны не попадают
+    number = RANGE_FIELDS[field](value)
+    if not math.isfinite(number):
+        raise ValueError(f"Не конечное число в поле {field}: {value}")
+    return number
+
+
+class Cancelled(Exception):
+    # долгую операцию отменили (его бросает обратный вызов progress)
+    pass
+
+
+def report_progress(progress, done, total=None):
+    # progress(done, total) - необязательный обратный вызов долгих операций (окно показывает по нему
+    # ход работы); отменить операцию он может, бросив исключение
+    if progress is not None and not done % PROGRESS_STEP:
+        progress(done, total)
+
+
+def make_record(record_id, name, faculty, course, gpa):
+    # приводим поля к нужным типам так же, как окно добавления записи; ValueError - если не вышло
+    return {
+        "id": int(record_id),
+        "name": str(name),
+        "faculty": str(faculty),
+        "course": int(course),
+        "gpa": range_value("gpa", gpa),
+    }
+
+
+class ReadWriteLock:
+    # много читателей одновременно или один писатель. Писатель может заходить повторно
+    # и читать; читатель может повторно читать, но не писать (это была бы взаимоблокировка).
+    # Ждущий писатель не пропускает вперёд новых читателей, чтобы поток поисков его не задушил.
+    # with lock: - монопольно, with lock.shared(): - на чтение
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._writer = None # поток-писатель
+        self._writer_depth = 0
+        self._readers = 0
+        self._waiting_writers = 0
+        self._local = threading.local() # глубина повторного входа на чтение у каждого потока
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def reading(self):
+        return getattr(self._local, 'depth', 0) > 0
+
+    def acquire_shared(self):
+        local = self._local
+        depth = getattr(local, 'depth', 0)
+        if not depth:
+            local.counted = self._writer != threading.get_ident() # писателю отдельно считаться не нужно
+            if local.counted:
+                with self._condition:
+                    while self._writer is not None or self._waiting_writers:
+                        self._condition.wait()
+                    self._readers += 1
+        local.depth = depth + 1
+
+    def release_shared(self):
+        local = self._local
+        local.depth -= 1
+        if not local.depth and local.counted:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield self
+        finally:
+            self.release_shared()
+
+
+def _locked(method):
+    # изменения базы идут монопольно: не пересекаются ни со сжатием в фоне, ни с поисками
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _writing(method):
+    # изменение базы: монопольно и среди потоков, и среди процессов (блокировка файла <база>.lock)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock, self._process_lock().exclusive():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _shared(method):
+    # только чтение под уже загруженным индексом - может идти параллельно с другими чтениями
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock.shared():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _query(method):
+    # запрос: индекс при необходимости перечитываем монопольно, а сам запрос идёт параллельно с другими
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self._lock.reading() and self.db_file and self._disk_state() != self._index_state:
+            with self._lock:
+                self.load_index()
+        with self._lock.shared():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Движок хранения без GUI: записи лежат в файле JSON lines (одна запись на строку)
+# или в компактном двоичном файле (см. formats.py), рядом лежит индекс-файл id -> смещение записи в байтах.
+# Им может пользоваться как окно на tkinter, так и скрипты / пакетные задачи.
+# Файл базы открывается для чтения один раз на сессию (mmap или обычный дескриптор),
+# а не на каждую запись.
+# Удаление дописывает в конец "надгробие" {"id": ..., "deleted": true}, а место, занятое
+# удалёнными записями, освобождается сжатием (compact), которое запускается в фоне,
+# когда доля мёртвых байт превышает compact_ratio.
+# Изменение записи тоже не переписывает файл: новая версия либо ложится на место старой
+# (если помещается, хвост добивается пробелами), либо дописывается в конец, а старая
+# становится мёртвой и выкидывается при сжатии.
+class StudentStorage:
+
+    def __init__(self, db_file=None, use_mmap=True, field_indexes=True, compact_ratio=0.5, compact_min_bytes=64 * 1024,
+                 checkpoint_min_entries=1000):
+        self.db_file = db_file
+        self.index = {}
+        self.checkpoint_min_entries = checkpoint_min_entries # журнал короче этого не сворачиваем в снимок
+        self._pending = [] # строки журнала индекса, ещё не записанные на диск
+        # id изменённых записей по порядку - для тех, кто обновляет свои данные по приращениям
+        # (аналитика); эпоха меняется, когда индекс заменён целиком и приращений нет
+        self._changed = []
+        self._changes_epoch = 0
+        self._log_entries = 0 # сколько строк уже в журнале
+        self._checkpoint = 0 # номер последней контрольной точки индекса
+        self._log_position = 0 # до какого байта журнал уже применён к индексу в памяти
+        self._index_state = None # состояние файлов на диске, которому соответствует индекс в памяти
+        self._data_header = None # размер, mtime и контрольная сумма файла базы, которым соответствует индекс
+        # наименьшее смещение, с которого файл базы переписывался на месте (правка записи, заголовок,
+        # сжатие) с последнего бэкапа; None - только дописывался, и следующий бэкап может быть инкрементальным
+        self._rewritten_from = 0
+        self._rewritten_since = None # номер бэкапа, с которого отсчитывается _rewritten_from (только в снимке)
+        # вторичные индексы (необязательные), хранятся рядом в файле .fields
+        self.field_indexes = {field: {} for field in INDEXED_FIELDS} if field_indexes else None
+        # упорядоченные индексы: поле -> отсортированный список различных значений
+        # (id берутся из основного индекса, остальные - из ключей вторичного)
+        self.sorted_keys = {field: [] for field in RANGE_FIELDS} if field_indexes else None
+        # индексы триграмм текстовых полей: поле -> триграмма -> множество ключей (не id) с ней
+        self.text_indexes = {field: {} for field in TEXT_FIELDS} if field_indexes else None
+        self.dead_bytes = 0 # байты удалённых и устаревших строк в файле базы
+        self.compact_ratio = compact_ratio # None - не сжимать автоматически
+        self.compact_min_bytes = compact_min_bytes # маленькие файлы не сжимаем
+        self.last_reclaimed = 0 # сколько байт освободило последнее сжатие
+        self.use_mmap = use_mmap
+        self._format = formats.JsonLinesFormat() # формат файла базы, определяется по самому файлу
+        self._file = None # постоянный дескриптор на чтение
+        self._map = None # отображение файла в память (если use_mmap и файл не пустой)
+        self._mapped_size = 0
+        self._lock = ReadWriteLock()
+        self._reader_lock = threading.Lock() # переотображение файла параллельными читателями
+        self._file_lock = FileLock(None) # блокировка базы между процессами, см. _process_lock
+        self._compaction = None # фоновый поток сжатия
+        self.metrics = Metrics() # счётчики и время операций (см. metrics.py)
+
+    # --- файл базы целиком ---
+
+    @_locked
+    @timed("create")
+    def create(self, db_file, record_format="jsonl"):
+        # record_format: "jsonl" или "binary" (formats.FORMATS); при открытии формат узнаётся по файлу
+        self._close_reader()
+        self.db_file = db_file
+        self.index.clear()
+        self._format = formats.make(record_format, db_file)
+        with self._process_lock().exclusive():
+            self._write_empty_file()
+            self.rebuild_index()
+
+    @_locked
+    @timed("open")
+    def open(self, db_file, progress=None):
+        # индекс с диска берём как есть, если файл базы с ним сходится (см. _check_data_file);
+        # целиком файл сканируется, только если индекса нет или он не годится
+        self._close_reader()
+        self.db_file = db_file
+        self.index.clear()
+        self._index_state = None
+        self.load_index(progress)
+
+    def close(self):
+        self.wait_compaction()
+        with self._lock:
+            self._close_reader()
+            self._file_lock.close()
+            self.db_file = None
+            self.index = {}
+            self.dead_bytes = 0
+            self._index_state = None
+
+    def drop(self):
+        self.wait_compaction()
+        with self._lock:
+            if self.db_file and os.path.exists(self.db_file):
+                self._close_reader()
+                with self._process_lock().exclusive():
+                    os.remove(self.db_file)
+                    for suffix in (".index", ".index.log", ".fields"):
+                        if os.path.exists(self.db_file + suffix):
+                            os.remove(self.db_file + suffix)
+                self._file_lock.remove()
+                self.close()
+                return True
+            return False
+
+    @_writing
+    @timed("clear")
+    def clear(self):
+        if self.db_file:
+            self._close_reader()
+            self._write_empty_file()
+            self.index = {}
+            self.dead_bytes = 0
+            self._mark_rewritten(0)
+            self._reset_changes()
+            self._rebuild_field_indexes()
+            self.checkpoint_index()
+
+    def _write_empty_file(self):
+        # пустой файл базы (у двоичного - только заголовок) пишем рядом и подменяем им старый, как при сжатии:
+        # обрезка на месте уронила бы (SIGBUS) другие процессы, читающие старый файл через mmap
+        temp_file = self.db_file + ".temp"
+        with open(temp_file, 'wb') as f:
+            f.write(self._format.header_bytes())
+        os.replace(temp_file, self.db_file)
+
+    @_writing
+    @timed("backup")
+    def backup(self, compress=True, full=False, progress=None):
+        # очередной нумерованный бэкап (полный или только дописанное с прошлого) вместе с индексом
+        if not self.db_file:
+            return None
+        self.load_index()
+        self._recover_tail() # файл мог поменяться мимо журнала (сбой другого процесса)
+        self.save_index() # журнал на диске должен соответствовать файлу базы
+        last = backups.last_backup(self.db_file)
+        number = last["number"] + 1 if last else 1
+        # отметке о переписанном можно верить, только если она отсчитывается не позже последнего бэкапа
+        # из списка; иначе (бэкап не дописался, бэкапы удалили) что переписано после него, неизвестно
+        known = last is not None and self._rewritten_since is not None and self._rewritten_since <= last["number"]
+        rewritten_from = self._rewritten_from if known else 0
+        if self._rewritten_from is not None or self._rewritten_since is None or self._rewritten_since > number:
+            # отметку обнуляем до копирования: снимок с ней попадает в этот же бэкап, и следующий
+            # продолжит цепочку и данных, и индекса. Если бэкап не допишется, номера number
+            # в списке не будет - и следующий бэкап будет полным
+            self._rewritten_from = None
+            self._rewritten_since = number
+            self.checkpoint_index()
+        return backups.create_backup(self.db_file, compress, full, progress, rewritten_from,
+                                     self._checkpoint, self._log_position)
+
+    @_writing
+    @timed("convert")
+    def convert(self, target_file, record_format=None, progress=None):
+        # копия базы в другом формате (formats.convert_file); пока она пишется, базу не меняют
+        if not self.db_file:
+            return None
+        if os.path.abspath(target_file) == os.path.abspath(self.db_file):
+            raise ValueError("Нельзя преобразовать открытую базу в саму себя")
+        self.load_index()
+        return formats.convert_file(self.db_file, target_file, record_format, progress)
+
+    @timed("restore")
+    def restore(self, directory, number=None, progress=None):
+        self.wait_compaction()
+        with self._lock, self._process_lock().exclusive():
+            self._close_reader()
+            entry = backups.restore_backup(self.db_file, directory, number, progress)
+            self._index_state = None
+            self.load_index() # индекс берём из бэкапа, файл базы заново не сканируем
+            self._mark_rewritten(0) # файл заменён целиком - от него бэкапы цепочкой не продолжить
+            self.checkpoint_index()
+            return entry
+
+    # --- постоянный читатель файла ---
+
+    def _open_reader(self, close_old=True):
+        if close_old or self._file is None:
+            self._close_reader()
+            if not self.db_file or not os.path.exists(self.db_file):
+                return
+            self._file = open(self.db_file, 'rb')
+        else:
+            # файл дорос - переотображаем через тот же дескриптор, то есть тот же файл (inode):
+            # если другой процесс подменил файл сжатием, наши смещения остаются верными для
+            # старого файла, пока индекс не перечитан. Параллельные читатели могут ещё держать
+            # срезы старого отображения - его не закрываем, оно освободится само
+            self._map = None
+        self._mapped_size = os.fstat(self._file.fileno()).st_size
+        if self.use_mmap and self._mapped_size: # пустой файл отобразить нельзя
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_reader(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass # кто-то ещё держит срез, отображение закроется вместе с ним
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._mapped_size = 0
+
+    def _read_line(self, position):
+        # срез записи по смещению без разделителя (у JSON lines - без перевода строки), одинаковый
+        # с mmap и без него; для mmap - без копирования.
+        # Сюда могут зайти несколько читателей сразу, поэтому отображение берём в локальную
+        # переменную, а переоткрытие файла и чтение через обычный дескриптор - под _reader_lock
+        mapped = self._map
+        if mapped is None or position >= len(mapped):
+            with self._reader_lock:
+                if self._file is None or position >= self._mapped_size:
+                    self._open_reader(close_old=False) # после дописывания файл вырос - переотображаем
+                mapped = self._map
+                if mapped is None:
+                    if self._file is None:
+                        return memoryview(b'')
+                    self._file.seek(position)
+                    return memoryview(self._format.read_frame(self._file))
+        return memoryview(mapped)[position:self._format.frame_end(mapped, position)]
+
+    @_shared
+    def read_raw(self, record_id):
+        # сырые байты записи без копирования; срез нужно освободить (release) до изменения базы
+        record_id = str(record_id)
+        if not self.db_file or record_id not in self.index:
+            return None
+        return self._read_line(self.index[record_id])
+
+    def _line_lengths(self, record_id):
+        # (длина строки записи вместе с переводом строки (у двоичного формата - длина кадра),
+        #  сколько из неё живых байт): заполнители после перезаписи на месте уже посчитаны мёртвыми
+        with self._read_line(self.index[record_id]) as line_bytes:
+            return len(line_bytes) + self._format.separator, self._format.live_length(line_bytes)
+
+    # --- индекс ---
+    # Индекс хранится как снимок (.index) плюс журнал изменений (.index.log).
+    # В памяти он живёт всю сессию и перечитывается, только если файлы на диске поменялись
+    # (например, их изменил другой экземпляр программы).
+    # Каждая операция дописывает в журнал по строке на изменённый id, а снимок
+    # переписывается целиком только при контрольной точке, когда журнал дорос
+    # до размера самого индекса, - так вставка остаётся O(1) в среднем.
+    # И в снимке, и в последней строке каждой порции журнала лежит заголовок файла базы
+    # (размер, mtime, контрольная сумма начала и конца): при открытии по нему видно, можно ли
+    # взять индекс как есть, дочитать только дописанные в базу строки или надо перестраивать всё.
+
+    def _disk_state(self):
+        # (inode, размер, mtime) файла базы, снимка индекса и журнала - по ним видно, менялось ли что-то на диске
+        state = []
+        for path in (self.db_file, self.db_file + ".index", self.db_file + ".index.log"):
+            try:
+                st = os.stat(path)
+                state.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def load_index(self, progress=None):
+        # индекс держим в памяти; с диска перечитываем, только если файлы изменились
+        if not self.db_file:
+            return
+        state = self._disk_state()
+        if state == self._index_state:
+            return
+        old_state, self._index_state = self._index_state, None
+        if old_state is not None and old_state[0] is not None and (state[0] is None or state[0][0] != old_state[0][0]):
+            self._close_reader() # файл базы подменили (сжатие) - старое отображение не годится
+        if old_state is not None and state[1] == old_state[1] and state[2] is not None and old_state[2] is not None \
+                and state[2][0] == old_state[2][0] and state[2][1] >= self._log_position:
+            # снимок тот же, журнал только дописали - накатываем лишь его хвост;
+            # под блокировкой на чтение другой процесс не допишет журнал, пока мы его читаем
+            with self._process_lock().shared(), self.metrics.timer("index_tail_replay"):
+                self._format.read_header(self.db_file) # в таблицу факультетов мог дописать другой процесс
+                if self._replay_index_log(self.field_indexes is not None, self._log_position):
+                    self._index_state = self._disk_state()
+                    return
+        # полная загрузка может перестроить индекс или обрезать журнал - только монопольно
+        with self._process_lock().exclusive():
+            self._load_index_files(progress)
+            if self._index_state is None:
+                self._index_state = self._disk_state()
+
+    def _process_lock(self):
+        # блокировка между процессами привязана к текущему файлу базы
+        path = self.db_file + ".lock" if self.db_file else None
+        if self._file_lock.path != path:
+            self._file_lock.close()
+            self._file_lock = FileLock(path)
+        return self._file_lock
+
+    def is_stale(self):
+        # изменил ли базу кто-то другой (другой процесс) с тех пор, как индекс загружен
+        return bool(self.db_file) and self._disk_state() != self._index_state
+
+    @timed("index_load")
+    def _load_index_files(self, progress=None):
+        self._reset_changes()
+        self._format = formats.detect(self.db_file)
+        index_file = self.db_file + ".index" # файл индекса находится рядом с файлом базы
+        try:
+            with open(index_file, 'r') as f:
+                stored = json.load(f)
+                if isinstance(stored.get("records"), dict):
+                    self.index = stored["records"]
+                    self.dead_bytes = stored.get("dead_bytes", 0)
+                    self._checkpoint = stored.get("checkpoint", 0)
+                    self._data_header = stored.get("data")
+                    self._rewritten_from = stored.get("rewritten", 0)
+                    self._rewritten_since = stored.get("rewritten_since")
+                else: # старый формат: в файле только id -> смещение
+                    self.index = stored
+                    self.dead_bytes = 0
+                    self._checkpoint = 0
+                    self._data_header = None
+                    self._rewritten_from = 0
+                    self._rewritten_since = None
+                self.metrics.count("index_loads")
+                self.metrics.count("index_bytes_read", f.tell())
+                log.debug("Индекс загружен: %d записей, контрольная точка %d", len(self.index), self._checkpoint)
+        except (FileNotFoundError, json.JSONDecodeError, AttributeError):  # если с индексом что-то не так, то мы его переделываем
+            log.info("Индекс %s не прочитан, перестраиваем", index_file)
+            self.rebuild_index(progress)
+            return
+        self._pending = []
+        self._log_entries = 0
+        fields_loaded = self._load_field_indexes()
+        if not self._replay_index_log(fields_loaded, 0, truncate=True):
+            log.warning("Журнал индекса не сходится с базой, перестраиваем индекс")
+            self.rebuild_index(progress)
+            return
+        if not self._check_data_file(progress):
+            log.warning("Файл базы не сходится с индексом, перестраиваем индекс")
+            self.rebuild_index(progress)
+            return
+        if not fields_loaded:
+            self._rebuild_field_indexes(progress)
+            self.checkpoint_index()
+
+    def _replay_index_log(self, replay_fields, start, truncate=False):
+        # накатываем журнал на индекс в памяти, начиная с байта start;
+        # оборванную при сбое последнюю строку не применяем (а при полной загрузке - отрезаем)
+        log_file = self.db_file + ".index.log"
+        data_size = os.path.getsize(self.db_file) if os.path.exists(self.db_file) else 0
+        try:
+            f = open(log_file, 'rb')
+        except FileNotFoundError:
+            self._log_position = 0
+            return True
+        with f:
+            f.seek(start)
+            good_size = start
+            for line_bytes in f:
+                if not line_bytes.endswith(b'\n'):
+                    break # запись в журнал не успела закончиться
+                try:
+                    entry = json.loads(line_bytes)
+                    record_id, offset = entry["id"], entry["offset"]
+                except (ValueError, KeyError, TypeError):
+                    break
+                if offset is not None and offset >= data_size:
+                    return False # журнал указывает за конец файла базы
+                if offset is None:
+                    self.index.pop(record_id, None)
+                else:
+                    self.index[record_id] = offset
+                self.dead_bytes = entry.get("dead", self.dead_bytes)
+                # заголовок файла базы есть в последней строке каждой порции журнала; если его нет
+                # (журнал оборван посреди порции или записан старой версией) - проверить файл будет нечем
+                self._data_header = entry.get("data")
+                if "rewritten" in entry:
+                    self._rewritten_from = entry["rewritten"]
+                if replay_fields:
+                    self._update_fields(record_id, entry.get("old"), entry.get("new"))
+                self._changed.append(record_id)
+                self._log_entries += 1
+                self.metrics.count("log_entries_replayed")
+                good_size += len(line_bytes)
+        if truncate and good_size < os.path.getsize(log_file):
+            log.warning("Отрезаем оборванный хвост журнала индекса: %d байт", os.path.getsize(log_file) - good_size)
+            with open(log_file, 'r+b') as f:
+                f.truncate(good_size)
+        self.metrics.count("log_bytes_read", good_size - start)
+        self._log_position = good_size
+        return True
+
+    def _read_data_header(self):
+        try:
+            with open(self.db_file, 'rb') as f:
+                st = os.fstat(f.fileno())
+                return {"size": st.st_size, "mtime": st.st_mtime_ns, "crc": self._data_checksum(st.st_size, f)}
+        except FileNotFoundError:
+            return None
+
+    def _data_checksum(self, size, f=None):
+        # crc32 первых и последних CHECK_BYTES байт из [0, size): весь файл ради проверки не читаем,
+        # а подмену файла, обрезку и переписанный конец так видно
+        if f is None:
+            with open(self.db_file, 'rb') as f:
+                return self._data_checksum(size, f)
+        checksum = zlib.crc32(f.read(min(size, CHECK_BYTES)))
+        if size > CHECK_BYTES:
+            f.seek(max(CHECK_BYTES, size - CHECK_BYTES))
+            checksum = zlib.crc32(f.read(size - f.tell()), checksum)
+        return checksum
+
+    def _check_data_file(self, progress=None):
+        # сходится ли файл базы с заголовком загруженного индекса; строки, дописанные
+        # в базу после сохранения индекса, дочитываются сразу. False - индекс надо перестроить
+        expected = self._data_header
+        if expected is None:
+            return False # индекс старой версии или журнал оборван - сверить не с чем
+        try:
+            st = os.stat(self.db_file)
+        except FileNotFoundError:
+            return False
+        if st.st_size == expected["size"] and st.st_mtime_ns == expected["mtime"]:
+            return True
+        # файл трогали (копирование, восстановление) или дописали - сверяем известную индексу часть
+        if st.st_size < expected["size"] or self._data_checksum(expected["size"]) != expected["crc"]:
+            return False
+        self._mark_rewritten(0) # что ещё в файле переписали мимо журнала, не знаем - следующий бэкап полный
+        if st.st_size > expected["size"]:
+            self._scan_appended(expected["size"], progress)
+        return True
+
+    def _scan_appended(self, start, progress=None):
+        # разбираем строки с байта start до конца файла (дописаны без обновления индекса: другой
+        # программой или до сбоя, не давшего записать журнал) и заносим их в индекс и журнал
+        size = os.path.getsize(self.db_file)
+        position = start
+        lines = 0
+        with open(self.db_file, 'rb') as f:
+            f.seek(start)
+            for lines, line_bytes in enumerate(self._format.frames(f), 1):
+                if progress is not None and not lines % PROGRESS_STEP:
+                    progress(position - start, size - start)
+                torn = self._format.torn(line_bytes)
+                if torn: # запись оборвалась при сбое - закрываем её, пока после неё ничего не дописали
+                    line_bytes = self._seal_tail(position, line_bytes)
+                try:
+                    record = self._format.decode(line_bytes)
+                    if record is not None:
+                        record_id = str(record.get('id'))
+                        deleted = record.get('deleted')
+                except (ValueError, AttributeError):
+                    log.warning("Пропускаем некорректную запись на смещении %d", position)
+                    self.metrics.count("corrupt_lines")
+                    record = None
+                if record is None: # мусор или пустое место
+                    self.dead_bytes += len(line_bytes)
+                else:
+                    old_record = None
+                    if record_id in self.index:
+                        old_record = self._load_record(record_id)
+                        self.dead_bytes += self._line_lengths(record_id)[1]
+                    if deleted:
+                        self.dead_bytes += len(line_bytes)
+                        if self.index.pop(record_id, None) is not None:
+                            self._log_change(record_id, old_record, None)
+                    else:
+                        self.dead_bytes += len(line_bytes) - self._format.live_length(line_bytes)
+                        self.index[record_id] = position
+                        self._log_change(record_id, old_record, record)
+                position += len(line_bytes)
+                if torn:
+                    break # дальше f дочитал бы то, что дописал _seal_tail
+        self.metrics.count("records_scanned", lines)
+        self.metrics.count("bytes_read", position - start)
+        log.info("Дочитаны строки, дописанные в базу после сохранения индекса: %d байт", position - start)
+        if self._pending:
+            self.save_index()
+        else:
+            self.checkpoint_index() # в хвосте только мусор - запоминаем новый размер файла
+
+    def _seal_tail(self, position, frame):
+        # оборванную последнюю запись (frame со смещения position) закрываем на месте (formats: sealed),
+        # а не отрезаем: файл базы не укорачивается, пока его могут читать через mmap другие процессы
+        sealed = self._format.sealed(frame)
+        log.warning("Запись в конце файла базы оборвана (смещение %d, %d байт), закрываем её", position, len(frame))
+        self.metrics.count("torn_tails")
+        with open(self.db_file, 'r+b') as f:
+            f.seek(position)
+            f.write(sealed)
+        self._mark_rewritten(position)
+        return sealed
+
+    def _mark_rewritten(self, position):
+        # байты с position переписаны на месте - бэкап, сохранивший их, продолжать инкрементом нельзя
+        if self._rewritten_from is None or position < self._rewritten_from:
+            self._rewritten_from = position
+
+    def _recover_tail(self):
+        # перед дописыванием: если в конце файла есть байты, которых нет в индексе (другой процесс
+        # упал посреди дописывания), сначала дочитываем их и закрываем оборванную запись -
+        # иначе новая запись склеится с обрывком и пропадёт при следующей перестройке или сжатии.
+        # Файл того же размера, но с другим mtime переписывали мимо журнала - это видно бэкапу
+        data_state = self._index_state[0] if self._index_state else None
+        expected = self._data_header
+        if data_state is None or expected is None or data_state[1:] == (expected["size"], expected["mtime"]):
+            return
+        if not self._check_data_file():
+            log.warning("Файл базы не сходится с индексом, перестраиваем индекс")
+            self.rebuild_index()
+
+    @_writing
+    def save_index(self):
+        # сбрасываем накопленные изменения в журнал, при необходимости - контрольная точка
+        if not self.db_file or not self._pending:
+            return
+        self._data_header = self._read_data_header()
+        # мёртвые байты могли прибавиться и после последнего изменения (мусорные строки)
+        self._pending[-1] = dict(self._pending[-1], dead=self.dead_bytes, data=self._data_header,
+                                 rewritten=self._rewritten_from)
+        lines = b''.join((encode_json(entry) + '\n').encode('utf-8') for entry in self._pending)
+        log_file = self.db_file + ".index.log"
+        with open(log_file, 'r+b' if os.path.exists(log_file) else 'wb') as f:
+            # всё после применённой части журнала - оборванная при сбое строка, дописываем поверх неё
+            f.seek(self._log_position)
+            f.truncate()
+            f.write(lines)
+        self.metrics.count("log_entries_written", len(self._pending))
+        self.metrics.count("log_bytes_written", len(lines))
+        self._log_entries += len(self._pending)
+        self._log_position += len(lines)
+        self._pending = []
+        if self._log_entries >= max(self.checkpoint_min_entries, len(self.index)):
+            self.checkpoint_index()
+        else:
+            self._index_state = self._disk_state() # свои изменения перечитывать не нужно
+
+    @_writing
+    @timed("checkpoint")
+    def checkpoint_index(self):
+        # атомарно переписываем снимок индекса (и вторичных индексов) и обнуляем журнал;
+        # если упадём между заменой снимка и очисткой журнала - повторный накат журнала безвреден
+        if not self.db_file:
+            return
+        self._checkpoint += 1
+        self._save_field_indexes()
+        self._data_header = self._read_data_header()
+        index_file = self.db_file + ".index"
+        with open(index_file + ".temp", 'w') as f:
+            # dumps, а не dump: dump кодирует кусками на чистом Python и на больших индексах в разы медленнее
+            f.write(json.dumps({"checkpoint": self._checkpoint, "dead_bytes": self.dead_bytes, "data": self._data_header,
+                                "rewritten": self._rewritten_from, "rewritten_since": self._rewritten_since,
+                                "records": self.index}))
+            self.metrics.count("index_bytes_written", f.tell())
+        os.replace(index_file + ".temp", index_file)
+        self.metrics.count("checkpoints")
+        with open(index_file + ".log", 'wb') as f:
+            pass
+        self._pending = []
+        self._log_entries = 0
+        self._log_position = 0
+        self._index_state = self._disk_state()
+
+    def _log_change(self, record_id, old_record, new_record, journal=True):
+        # изменение id уже сделано в self.index; обновляем вторичные индексы и запоминаем строку журнала
+        old_keys = self._field_keys(old_record)
+        new_keys = self._field_keys(new_record)
+        self._update_fields(record_id, old_keys, new_keys)
+        self._changed.append(record_id)
+        if len(self._changed) > 2 * len(self.index) + 1000:
+            self._reset_changes() # дешевле перечитать всё, чем хранить такой хвост
+        if journal:
+            self._pending.append({"id": record_id, "offset": self.index.get(record_id), "dead": self.dead_bytes,
+                              "old": old_keys, "new": new_keys})
+
+    def _reset_changes(self):
+        self._changed = []
+        self._changes_epoch += 1
+
+    @_locked
+    def changes_since(self, mark):
+        # (новая отметка, множество id изменённых с отметки mark записей);
+        # вместо множества - None, если приращений нет и данные надо перечитать целиком
+        self.load_index()
+        new_mark = (self._changes_epoch, len(self._changed))
+        if mark is None or mark[0] != self._changes_epoch:
+            return new_mark, None
+        return new_mark, set(self._changed[mark[1]:])
+
+    @_writing
+    @timed("rebuild_index")
+    def rebuild_index(self, progress=None):
+        # progress получает (прочитано байт, размер файла); при отмене индекс в памяти
+        # не достроен, поэтому при следующем обращении он перечитывается с диска
+        try:
+            self._rebuild_index(progress)
+        except Cancelled:
+            self._index_state = None
+            raise
+
+    def _rebuild_index(self, progress):
+        index = {}
+        lengths = {} # длины живых строк, чтобы посчитать мёртвое место
+        # ключи вторичных индексов собираем за тот же проход, чтобы не разбирать все записи второй раз
+        keys = {} if self.field_indexes is not None else None
+        start = position = self._format.header_size
+        if self.db_file and os.path.exists(self.db_file):
+            try:
+                size = os.path.getsize(self.db_file)
+                with open(self.db_file, 'rb') as f:
+                    f.seek(start)
+                    frames = self._format.frames(f)
+                    for line_number in itertools.count():
+                        if progress is not None and not line_number % PROGRESS_STEP:
+                            progress(position, size)
+                        line_bytes = next(frames, b'')
+                        if not line_bytes:
+                            break
+                        torn = self._format.torn(line_bytes)
+                        if torn: # запись оборвалась при сбое - закрываем, чтобы следующая не склеилась с ней
+                            line_bytes = self._seal_tail(position, line_bytes)
+                        try:
+                            record = self._format.decode(line_bytes)
+                            if record is None: # пустая строка или пустое место после перезаписи
+                                continue
+                            record_id = str(record.get('id'))
+                            if record.get('deleted'): # надгробие - запись удалена
+                                index.pop(record_id, None)
+                                lengths.pop(record_id, None)
+                                if keys is not None:
+                                    keys.pop(record_id, None)
+                            elif record_id:
+                                index[record_id] = position
+                                lengths[record_id] = self._format.live_length(line_bytes) # заполнители после перезаписи на месте - мёртвые
+                                if keys is not None:
+                                    keys[record_id] = self._field_keys(record)
+                        except (ValueError, AttributeError): # не JSON или JSON, но не объект (123, [...])
+                            log.warning("Пропускаем некорректную запись на смещении %d", position)
+                            self.metrics.count("corrupt_lines")
+                        finally:
+                            position += len(line_bytes) # инкремент в байтах независимо от исключения
+                        if torn:
+                            break # это был конец файла, а дальше f дочитал бы закрывающие байты
+                    self.metrics.count("records_scanned", line_number)
+            except Cancelled:
+                raise
+            except Exception as e:
+                log.error("Ошибка перестройки индекса: %s", e)
+        self.metrics.count("index_rebuilds")
+        self.metrics.count("bytes_read", position)
+        self._reset_changes()
+        self.index = index
+        self.dead_bytes = max(0, position - start - sum(lengths.values()))
+        self._mark_rewritten(0) # индекс строится заново, когда о прошлом файла ничего не известно
+        self._rebuild_field_indexes(progress, keys)
+        self.checkpoint_index()
+
+    # --- вторичные индексы: поле -> значение -> множество id ---
+    # На диск (.fields) пишутся только в контрольной точке, между ними их изменения
+    # восстанавливаются из журнала индекса (в нём есть старые и новые значения полей).
+    # Там же хранятся упорядоченные индексы числовых полей для запросов по диапазону
+    # и индексы триграмм имени и факультета для поиска по части слова.
+
+    def _load_field_indexes(self):
+        # False - файла нет, он битый или от другой контрольной точки, индексы надо строить заново
+        if self.field_indexes is None:
+            return True
+        try:
+            with open(self.db_file + ".fields", 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get("checkpoint") != self._checkpoint or stored.get("version") != FIELDS_VERSION:
+                return False
+            self.field_indexes = {field: {key: set(ids) for key, ids in stored["fields"][field].items()} for field in INDEXED_FIELDS}
+            self.sorted_keys = {field: stored["sorted"][field] for field in RANGE_FIELDS}
+            self.text_indexes = {field: {gram: set(keys) for gram, keys in stored["text"][field].items()}
+                                 for field in TEXT_FIELDS}
+            return True
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, AttributeError):
+            return False
+
+    def _save_field_indexes(self):
+        if self.field_indexes is None:
+            return
+        stored = {field: {key: list(ids) for key, ids in values.items()} for field, values in self.field_indexes.items()}
+        text = {field: {gram: list(keys) for gram, keys in grams.items()} for field, grams in self.text_indexes.items()}
+        fields_file = self.db_file + ".fields"
+        with open(fields_file + ".temp", 'w', encoding='utf-8') as f:
+            f.write(encode_json({"version": FIELDS_VERSION, "checkpoint": self._checkpoint, "fields": stored,
+                                 "sorted": self.sorted_keys, "text": text}))
+        os.replace(fields_file + ".temp", fields_file)
+
+    def _rebuild_field_indexes(self, progress=None, keys=None):
+        # keys: id -> ключи записи, если они уже известны; иначе записи читаются из файла
+        if self.field_indexes is None:
+            return
+        self.field_indexes = {field: {} for field in INDEXED_FIELDS}
+        self.sorted_keys = None # вставлять по одному в отсортированный список дорого - отсортируем в конце
+        self.text_indexes = None # и триграммы строим один раз по готовым ключам
+        for done, record_id in enumerate(self.index):
+            report_progress(progress, done, len(self.index))
+            record_keys = keys.get(record_id) if keys is not None else self._field_keys(self._load_record(record_id))
+            if record_keys:
+                self._update_fields(record_id, None, record_keys)
+        self._build_sorted_keys()
+        self._build_text_indexes()
+
+    def _build_sorted_keys(self):
+        self.sorted_keys = {field: [] for field in RANGE_FIELDS}
+        for field in RANGE_FIELDS:
+            keys = self.index if field == "id" else self.field_indexes[field]
+            for key in keys:
+                try:
+                    self.sorted_keys[field].append(range_value(field, key))
+                except ValueError:
+                    continue
+            self.sorted_keys[field].sort()
+
+    def _build_text_indexes(self):
+        self.text_indexes = {field: {} for field in TEXT_FIELDS}
+        for field in TEXT_FIELDS:
+            for key in self.field_indexes[field]:
+                self._text_add(field, key)
+
+    def _text_add(self, field, key):
+        grams = self.text_indexes[field]
+        for gram in text_grams(f" {key} "):
+            keys = grams.get(gram)
+            if keys is None:
+                keys = grams[gram] = set()
+            keys.add(key)
+
+    def _text_remove(self, field, key):
+        grams = self.text_indexes[field]
+        for gram in text_grams(f" {key} "):
+            keys = grams.get(gram)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del grams[gram]
+
+    def _sorted_add(self, field, key):
+        try:
+            value = range_value(field, key)
+        except ValueError:
+            return
+        values = self.sorted_keys[field]
+        i = bisect.bisect_left(values, value)
+        if i == len(values) or values[i] != value:
+            values.insert(i, value)
+
+    def _sorted_remove(self, field, key):
+        try:
+            value = range_value(field, key)
+        except ValueError:
+            return
+        values = self.sorted_keys[field]
+        i = bisect.bisect_left(values, value)
+        if i < len(values) and values[i] == value:
+            del values[i]
+
+    def _field_keys(self, record):
+        # ключи записи во вторичных индексах в порядке INDEXED_FIELDS (None - поля нет или в нём мусор)
+        if self.field_indexes is None or not record:
+            return None
+        try: # обычная запись - без цикла по полям
+            return [fold_text(record["name"]), fold_text(record["faculty"]),
+                    str(int(record["course"])), repr(float(record["gpa"]))]
+        except (KeyError, TypeError, ValueError):
+            pass
+        keys = []
+        for field in INDEXED_FIELDS:
+            try:
+                keys.append(field_key(field, record.get(field)))
+            except (TypeError, ValueError):
+                keys.append(None)
+        return keys
+
+    def _update_fields(self, record_id, old_keys, new_keys):
+        # old_keys None - запись добавлена, new_keys None - удалена
+        if self.field_indexes is None:
+            return
+        sorted_keys = self.sorted_keys
+        text_indexes = self.text_indexes
+        if sorted_keys is not None:
+            if old_keys is None and new_keys is not None:
+                self._sorted_add("id", record_id)
+            elif new_keys is None and old_keys is not None:
+                self._sorted_remove("id", record_id)
+        for field, key in zip(INDEXED_FIELDS, old_keys or ()):
+            ids = self.field_indexes[field].get(key)
+            if ids:
+                ids.discard(record_id)
+                if not ids:
+                    del self.field_indexes[field][key]
+                    if sorted_keys is not None and field in RANGE_FIELDS:
+                        self._sorted_remove(field, key)
+                    elif text_indexes is not None and field in text_indexes:
+                        self._text_remove(field, key)
+        for field, key in zip(INDEXED_FIELDS, new_keys or ()):
+            if key is not None:
+                ids = self.field_indexes[field].get(key)
+                if ids is None:
+                    ids = self.field_indexes[field][key] = set()
+                    if sorted_keys is not None and field in RANGE_FIELDS:
+                        self._sorted_add(field, key)
+                    elif text_indexes is not None and field in text_indexes:
+                        self._text_add(field, key)
+                ids.add(record_id)
+
+    # --- записи ---
+
+    @_shared
+    def load_record(self, record_id):
+        return self._load_record(record_id)
+
+    def _load_record(self, record_id):
+        # то же без блокировки - для вызовов из операций, которые её уже держат
+        if not self.db_file or record_id not in self.index:
+            return None
+        try:
+            with self._read_line(self.index[record_id]) as line_bytes:
+                self.metrics.count_read(len(line_bytes))
+                return self._format.decode(line_bytes)
+        except (IOError, OSError, ValueError) as e:
+            log.error("Ошибка загрузки %s: %s", record_id, e)
+            return None
+
+    def rebuild_database_file(self, progress=None):
+        # переписываем все живые записи во временный файл;
+        # новый индекс считаем по ходу записи, без повторного прохода по файлу
+        temp_file = self.db_file + ".temp" # временный файл
+        new_index = {}
+        try:
+            with open(temp_file, 'wb') as temp_f:
+                temp_f.write(self._format.header_bytes())
+                for done, existing_record_id in enumerate(self.index):
+                    report_progress(progress, done, len(self.index))
+                    with self._read_line(self.index[existing_record_id]) as line_bytes:
+                        json_bytes = self._format.trimmed(line_bytes) # заодно срезаем заполнители
+                    try:
+                        record = self._format.decode(json_bytes)
+                        if str(record.get('id')) != existing_record_id:
+                            log.warning("Пропускаем несовпавший id записи: ожидал %s, но получил %s",
+                                        existing_record_id, record.get('id'))
+                            continue
+                    except (ValueError, AttributeError):
+                        log.warning("Пропускаем некорректную запись с id %s", existing_record_id)
+                        self.metrics.count("corrupt_lines")
+                        continue
+                    new_index[existing_record_id] = temp_f.tell()
+                    temp_f.write(json_bytes)
+                self.metrics.count("records_scanned", len(self.index))
+                self.metrics.count("bytes_written", temp_f.tell())
+        except (IOError, OSError) as e:
+            log.error("Ошибка перестройки файла: %s", e)
+            return
+        except Cancelled:
+            os.remove(temp_file) # база не тронута, временный файл не нужен
+            raise
+        self._close_reader() # старое отображение больше не соответствует файлу
+        os.replace(temp_file, self.db_file)
+        self.index = new_index
+        self.dead_bytes = 0
+        self._mark_rewritten(0)
+        self.checkpoint_index()
+
+    # --- сжатие ---
+
+    @_writing
+    @timed("compact")
+    def compact(self, progress=None):
+        # выкидываем удалённые и устаревшие строки; возвращает число освобождённых байт
+        if not self.db_file or not os.path.exists(self.db_file):
+            return 0
+        self.load_index() # файл переписывается по индексу - в нём должно быть дописанное другими процессами
+        size_before = os.path.getsize(self.db_file)
+        self.rebuild_database_file(progress)
+        self.last_reclaimed = size_before - os.path.getsize(self.db_file)
+        self.metrics.count("compactions")
+        self.metrics.count("bytes_reclaimed", self.last_reclaimed)
+        log.info("Сжатие базы: освобождено %d байт", self.last_reclaimed)
+        return self.last_reclaimed
+
+    def dead_ratio(self):
+        if not self.db_file or not os.path.exists(self.db_file):
+            return 0.0
+        size = os.path.getsize(self.db_file)
+        return self.dead_bytes / size if size else 0.0
+
+    def compact_async(self):
+        # сжатие в фоновом потоке; операции с базой подождут его на блокировке
+        if self._compaction is not None and self._compaction.is_alive():
+            return self._compaction
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def wait_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _maybe_compact(self):
+        if self.compact_ratio is None or self.dead_bytes < self.compact_min_bytes:
+            return
+        if self.dead_ratio() >= self.compact_ratio:
+            self.compact_async()
+
+    def _write_record(self, f, end, record_id, record_data, journal=True):
+        # f открыт на чтение-запись и стоит в конце файла (end); новая запись дописывается,
+        # существующая - обновляется. Возвращает новый конец файла.
+        # seek у буферизованного файла сбрасывает буфер, поэтому при дописывании его не зовём
+        json_bytes = self._format.encode(record_data)
+        if self._format.header_changed:
+            # в таблицу факультетов двоичного формата добавился новый - заголовок пишем раньше записи
+            f.seek(0)
+            f.write(self._format.header_bytes())
+            f.seek(end)
+            self._format.header_changed = False
+            self._mark_rewritten(0)
+        old_record = None
+        if record_id in self.index:
+            f.flush() # старую версию читаем через отображение - всё записанное должно быть в файле
+            old_record = self._load_record(record_id)
+            old_length, old_live = self._line_lengths(record_id)
+            rewritten = self._format.rewrite(json_bytes, old_length)
+            if rewritten is not None:
+                # помещается на место старой версии - перезаписываем, добивая заполнителем
+                self._mark_rewritten(self.index[record_id])
+                f.seek(self.index[record_id])
+                f.write(rewritten)
+                f.seek(end)
+                self.dead_bytes += old_live - len(json_bytes)
+                self.metrics.count("records_written")
+                self.metrics.count("rewrites_in_place")
+                self.metrics.count("bytes_written", old_length)
+                self._log_change(record_id, old_record, record_data, journal)
+                return end
+            self.dead_bytes += old_live # старая версия остаётся в файле до сжатия
+        self.index[record_id] = end # считаем и записываем позицию
+        f.write(json_bytes)
+        self.metrics.count("records_written")
+        self.metrics.count("bytes_written", len(json_bytes))
+        self._log_change(record_id, old_record, record_data, journal)
+        return end + len(json_bytes)
+
+    # Одиночные операции: каждая загружает и сохраняет индекс.
+
+    @_query
+    @timed("get")
+    def get(self, record_id):
+        return self._load_record(str(record_id))
+
+    def put(self, record_data):
+        self.put_many([record_data])
+
+    def delete(self, record_id):
+        return self.delete_many([record_id]) == 1
+
+    def scan(self, progress=None):
+        with self._lock:
+            self.load_index()
+        yield from self._iter_records(progress)
+
+    @_query
+    def count(self):
+        return len(self.index)
+
+    @_query
+    @timed("page")
+    def page(self, start, count):
+        # записи с позиций [start, start + count) в порядке id - для показа таблицы окном;
+        # по упорядоченному индексу id - O(count) на любой позиции, без него - сортировка всех id
+        if self.sorted_keys is not None:
+            record_ids = map(str, self.sorted_keys["id"][start:start + count])
+        else:
+            record_ids = sorted(self.index, key=int)[start:start + count]
+        return [record for record in map(self._load_record, record_ids) if record]
+
+    def _iter_records(self, progress=None):
+        record_ids = list(self.index)
+        for done, record_id in enumerate(record_ids):
+            report_progress(progress, done, len(record_ids))
+            self.metrics.count("records_scanned")
+            record = self.load_record(record_id)
+            if record:
+                yield record
+
+    def _load_records(self, record_ids, progress=None):
+        records = []
+        for done, record_id in enumerate(record_ids):
+            report_progress(progress, done, len(record_ids))
+            record = self._load_record(record_id)
+            if record:
+                records.append(record)
+        return records
+
+    @_query
+    @timed("find")
+    def find(self, field, value, progress=None):
+        # поиск на равенство; по id - через основной индекс, по остальным полям - через вторичный
+        if field == "id":
+            record = self._load_record(str(int(value)))
+            return [record] if record else []
+        key = field_key(field, value)
+        if self.field_indexes is not None:
+            record_ids = sorted(self.field_indexes[field].get(key, ()), key=int)
+            return self._load_records(record_ids, progress)
+        # без вторичных индексов - полный проход по базе
+        results = []
+        for record in self._iter_records(progress):
+            try:
+                if field_key(field, record.get(field)) == key:
+                    results.append(record)
+            except (TypeError, ValueError):
+                continue
+        return results
+
+    @_query
+    @timed("find_range")
+    def find_range(self, field, low=None, high=None, include_low=True, include_high=True, limit=None, descending=False,
+                   progress=None):
+        # записи с low <= значение поля <= high (границы можно не задавать или сделать строгими),
+        # упорядоченные по полю; по упорядоченному индексу - O(log n + k)
+        number = RANGE_FIELDS[field]
+        low = None if low is None else number(low)
+        high = None if high is None else number(high)
+        if self.sorted_keys is None: # без индексов - полный проход и сортировка
+            return self._scan_range(field, low, high, include_low, include_high, limit, descending, progress)
+        values = self.sorted_keys[field]
+        start = 0 if low is None else (bisect.bisect_left if include_low else bisect.bisect_right)(values, low)
+        end = len(values) if high is None else (bisect.bisect_right if include_high else bisect.bisect_left)(values, high)
+        positions = range(end - 1, start - 1, -1) if descending else range(start, end)
+        results = []
+        loaded = 0
+        for position in positions:
+            value = values[position]
+            if field == "id":
+                record_ids = [str(value)]
+            else:
+                record_ids = sorted(self.field_indexes[field].get(field_key(field, value), ()), key=int)
+            for record_id in record_ids:
+                if limit is not None and len(results) >= limit:
+                    return results
+                report_progress(progress, loaded, limit)
+                loaded += 1
+                record = self._load_record(record_id)
+                if record:
+                    results.append(record)
+        return results
+
+    def top(self, field, k, lowest=False, progress=None):
+        # k записей с наибольшим (lowest=True - наименьшим) значением поля
+        return self.find_range(field, limit=k, descending=not lowest, progress=progress)
+
+    @_query
+    @timed("search")
+    def search(self, field, text, mode="fuzzy", limit=100, progress=None):
+        # поиск по части имени или факультета: mode "prefix" - слово в значении начинается с text,
+        # "substring" - значение содержит text, "fuzzy" - вдобавок похожие значения (опечатки).
+        # Результаты упорядочены по text_rank, при равенстве - по id. Кандидаты берутся из индекса
+        # триграмм, файл базы читается только для найденных записей
+        if field not in TEXT_FIELDS:
+            raise ValueError(f"Поиск по части значения - только по полям: {', '.join(TEXT_FIELDS)}")
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный вид поиска: {mode}")
+        query = " ".join(fold_text(text).split())
+        if not query:
+            return []
+        if self.text_indexes is None: # без индексов - полный проход по базе
+            return self._scan_search(field, query, mode, limit, progress)
+        record_ids = []
+        for rank in self._text_matches(field, query, mode):
+            record_ids.extend(sorted(self.field_indexes[field][rank[-1]], key=int))
+            if limit is not None and len(record_ids) >= limit:
+                break
+        return self._load_records(record_ids[:limit], progress)
+
+    def _text_matches(self, field, query, mode):
+        # места в выдаче (text_rank) подходящих значений поля, по порядку
+        grams = self.text_indexes[field]
+        probe = text_grams(f" {query}" if mode == "prefix" else query)
+        if probe: # подходят только значения со всеми триграммами запроса
+            sets = sorted((grams.get(gram, ()) for gram in probe), key=len)
+            candidates = set(sets[0]).intersection(*sets[1:])
+        else: # запрос короче триграммы - перебираем различные значения поля (в памяти, не в файле)
+            candidates = set(self.field_indexes[field])
+        hits = {}
+        query_grams = text_grams(f" {query} ")
+        if mode == "fuzzy": # похожие - сколько триграмм запроса есть в значении
+            for gram in query_grams:
+                for key in grams.get(gram, ()):
+                    hits[key] = hits.get(key, 0) + 1
+            candidates.update(hits)
+        ranks = []
+        for key in candidates:
+            rank = text_rank(key, query, mode, hits.get(key, 0) / len(query_grams))
+            if rank is not None:
+                ranks.append(rank)
+        ranks.sort()
+        return ranks
+
+    def _scan_search(self, field, query, mode, limit, progress=None):
+        query_grams = text_grams(f" {query} ")
+        matches = []
+        for record in self._iter_records(progress):
+            try:
+                key = fold_text(record[field])
+                record_id = int(record.get('id'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            score = len(text_grams(f" {key} ") & query_grams) / len(query_grams) if mode == "fuzzy" else 0.0
+            rank = text_rank(key, query, mode, score)
+            if rank is not None:
+                matches.append((rank, record_id, record))
+        matches.sort(key=lambda match: match[:2])
+        return [record for rank, record_id, record in matches[:limit]]
+
+    def _scan_range(self, field, low, high, include_low, include_high, limit, descending, progress=None):
+        matches = []
+        for record in self._iter_records(progress):
+            try:
+                value = range_value(field, record.get(field))
+            except (TypeError, ValueError):
+                continue
+            if low is not None and (value < low or (value == low and not include_low)):
+                continue
+            if high is not None and (value > high or (value == high and not include_high)):
+                continue
+            matches.append((value, record))
+        matches.sort(key=lambda match: int(match[1].get('id'))) # при равных значениях - по id, как в индексе
+        matches.sort(key=lambda match: match[0], reverse=descending)
+        return [record for value, record in matches[:limit]]
+
+    # Пакетные операции: один раз загружаем индекс и один раз сбрасываем его на диск.
+
+    @_query
+    @timed("get_many")
+    def get_many(self, record_ids):
+        records = {}
+        for record_id in record_ids:
+            record = self._load_record(str(record_id))
+            if record:
+                records[str(record_id)] = record
+        return records
+
+    @_writing
+    @timed("put_many")
+    def put_many(self, records, journal=True):
+        # добавление и изменение - O(1) на запись, файл базы целиком не переписывается;
+        # records может быть генератором - записи пишутся по мере поступления.
+        # journal=False (массовая загрузка): журнал не ведём, индекс сохраняется одной контрольной точкой
+        self.load_index()
+        if not self.db_file:
+            return
+        self._recover_tail()
+        mode = 'r+b' if os.path.exists(self.db_file) else 'w+b'
+        try:
+            with open(self.db_file, mode) as f:
+                end = f.seek(0, os.SEEK_END)
+                for record_data in records:
+                    end = self._write_record(f, end, str(record_data['id']), record_data, journal)
+        finally:
+            # и при отмене (исключении из генератора records) записанное должно попасть в индекс на диске
+            if self._map is None:
+                self._close_reader() # в буфере обычного дескриптора могли остаться старые версии строк
+            if journal:
+                self.save_index()
+            else:
+                self.checkpoint_index()
+        self._maybe_compact()
+
+    @_writing
+    @timed("delete_many")
+    def delete_many(self, record_ids):
+        # O(1) на запись: убираем id из индекса и дописываем надгробие, файл не переписываем
+        self.load_index()
+        if not self.db_file:
+            return 0
+        self._recover_tail()
+        tombstones = []
+        for record_id in record_ids:
+            record_id = str(record_id)
+            if record_id in self.index:
+                record = self._load_record(record_id)
+                tombstones.append(self._format.tombstone(record.get('id') if record else record_id))
+                self.dead_bytes += self._line_lengths(record_id)[1] + len(tombstones[-1])
+                del self.index[record_id]
+                self._log_change(record_id, record, None)
+        if tombstones:
+            with open(self.db_file, 'ab') as f: # сначала данные, потом журнал индекса
+                for tombstone in tombstones:
+                    f.write(tombstone)
+            self.metrics.count("tombstones_written", len(tombstones))
+            self.metrics.count("bytes_written", sum(map(len, tombstones)))
+            self.save_index()
+            self._maybe_compact()
+        return len(tombstones)
@@ -0,0 +1,42 @@
+import pytest
+
+from test_storage import new_storage, student
+
+np = pytest.importorskip("numpy") # без numpy отчёты в окне отключаются, проверять нечего
+
+from analytics import ColumnarSnapshot
+
+
+def test_snapshot_aggregates_and_refresh(tmp_path):
+    storage = new_storage(tmp_path / "db.json")
+    storage.put_many([student(1, faculty="ФИТ", course=1, gpa=4.0), student(2, faculty="ФИТ", course=2, gpa=3.0),
+                      student(3, faculty="ФМ", course=1, gpa=5.0)])
+    snapshot = ColumnarSnapshot(storage, chunk_size=2).refresh()
+    assert snapshot.count() == 3
+    assert snapshot.mean_gpa_by_faculty() == {"ФИТ": 3.5, "ФМ": 5.0}
+    assert snapshot.course_distribution() == {1: 2, 2: 1}
+    assert sorted(snapshot.filter_ids(course=1).tolist()) == [1, 3]
+
+    storage.put(student(2, faculty="ФМ", course=3, gpa=4.0))
+    storage.delete(1)
+    storage.put(student(4, faculty="Физический", course=1, gpa=2.0))
+    snapshot.refresh()
+    assert snapshot.count() == 3
+    assert snapshot.mean_gpa_by_faculty() == {"ФМ": 4.5, "Физический": 2.0}
+    assert snapshot.mean_gpa_by_course() == {1: 3.5, 3: 4.0}
+    storage.close()
+
+
+@pytest.mark.parametrize("record_format", ["jsonl", "binary"])
+def test_snapshot_survives_out_of_range_course(tmp_path, record_format):
+    storage = new_storage(tmp_path / "db", record_format)
+    storage.put(student(1, course=2))
+    snapshot = ColumnarSnapshot(storage).refresh()
+    storage.put(student(7, course=70000)) # движок такие курсы принимает
+    storage.put(student(1, course=2 ** 40))
+    snapshot.refresh()
+    assert snapshot.course_distribution() == {70000: 1}
+    storage.put(student(8, course=3))
+    assert snapshot.refresh().course_distribution() == {3: 1, 70000: 1}
+    assert ColumnarSnapshot(storage).refresh().course_distribution() == {3: 1, 70000: 1}
+    storage.close()
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+import bulk
+from storage import PROGRESS_STEP, Cancelled
+from test_storage import db_file, ids, new_storage, reopen, same_as_rebuild, student # noqa: F401 (db_file - фикстура)
+
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_csv_with_window_headers(tmp_path):
+    storage = new_storage(tmp_path / "db.json")
+    storage.put(student(1))
+    source = write_lines(tmp_path / "in.csv", [
+        "ID,Имя,Факультет,Курс,Средний балл", # заголовки как в таблице окна
+        "2,Петров Пётр,ФМ,2,4.5",
+        "1,Уже в базе,ФИТ,1,4.0",
+        "3,Сидоров,ФИТ,три,4.0",
+        "2,Повтор во входе,ФМ,1,3.0",
+        "4,Кузнецов,ФИТ,3,nan",
+        "5,Смирнова Анна,ФИТ,4,5.0",
+    ])
+    result = bulk.import_csv(storage, source)
+    assert (result["imported"], result["rejected"]) == (2, 4)
+    assert [line_number for line_number, error in result["errors"]] == [3, 4, 5, 6]
+    assert "такой ID уже есть: 1" in result["errors"][0][1] and "такой ID уже есть: 2" in result["errors"][2][1]
+    assert storage.get(2) == student(2, "Петров Пётр", "ФМ", 2, 4.5)
+    assert storage.get(1) == student(1) # запись из базы не перезаписана
+    assert ids(storage.scan()) == [1, 2, 5]
+    storage.close()
+
+
+def test_csv_with_json_headers_and_missing_column(tmp_path):
+    storage = new_storage(tmp_path / "db.json")
+    result = bulk.import_csv(storage, write_lines(tmp_path / "in.csv", ["id,name,faculty,course,gpa", "7,Иванов,ФИТ,1,4.0"]))
+    assert result["imported"] == 1 and storage.get(7) == student(7, "Иванов")
+    result = bulk.import_csv(storage, write_lines(tmp_path / "bad.csv", ["id,name,faculty,gpa", "8,Без курса,ФИТ,4.0"]))
+    assert (result["imported"], result["rejected"]) == (0, 1)
+    assert result["errors"] == [(2, "нет поля 'course'")]
+    assert storage.count() == 1
+    storage.close()
+
+
+def test_jsonl_rejects_bad_lines(tmp_path):
+    storage = new_storage(tmp_path / "db.json")
+    source = write_lines(tmp_path / "in.jsonl", [
+        json.dumps(student(1), ensure_ascii=False),
+        "не JSON",
+        "",
+        "[1, 2]",
+        json.dumps({"id": 2, "name": "Без факультета", "course": 1, "gpa": 4.0}, ensure_ascii=False),
+        json.dumps(dict(student(3), gpa="abc"), ensure_ascii=False),
+        json.dumps(student(4), ensure_ascii=False),
+    ])
+    result = bulk.import_jsonl(storage, source)
+    assert (result["imported"], result["rejected"]) == (2, 4)
+    assert [line_number for line_number, error in result["errors"]] == [2, 4, 5, 6]
+    assert ids(storage.scan()) == [1, 4]
+    storage.close()
+
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl"])
+def test_export_import_round_trip(db_file, tmp_path, extension):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    records = [student(record_id, f"Студент {record_id}, \"староста\"" if record_id == 3 else f"Студент {record_id}",
+                       faculty="ФИТ" if record_id % 2 else "Физический", course=record_id % 5 + 1,
+                       gpa=2.0 + record_id / 7) for record_id in range(20)]
+    storage.put_many(records)
+    storage.delete(5)
+    exported = str(tmp_path / ("out" + extension))
+    assert bulk.export_file(storage, exported) == 19
+    storage.close()
+
+    copy = new_storage(tmp_path / "copy.json")
+    result = bulk.import_file(copy, exported)
+    assert (result["imported"], result["rejected"]) == (19, 0)
+    assert sorted(copy.scan(), key=lambda record: record["id"]) == [record for record in records if record["id"] != 5]
+    assert bulk.import_file(copy, exported)["rejected"] == 19 # второй раз - все ID уже есть
+    copy.close()
+
+
+def test_cancelled_import_keeps_loaded_rows(db_file, tmp_path):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    source = write_lines(tmp_path / "in.jsonl", [json.dumps(student(record_id), ensure_ascii=False)
+                                                 for record_id in range(PROGRESS_STEP + 500)])
+
+    def progress(done, total=None):
+        if done >= PROGRESS_STEP:
+            raise Cancelled()
+
+    with pytest.raises(Cancelled):
+        bulk.import_jsonl(storage, source, progress)
+    assert storage.count() == PROGRESS_STEP
+    assert same_as_rebuild(storage)
+    storage.close()
+    storage = reopen(path)
+    assert ids(storage.scan()) == list(range(PROGRESS_STEP))
+    storage.close()
+
+
+def test_dataframe_round_trip(tmp_path):
+    pd = pytest.importorskip("pandas") # pandas нужен только для импорта и выгрузки таблиц
+    storage = new_storage(tmp_path / "db.json")
+    storage.put_many(student(record_id, course=record_id % 4 + 1) for record_id in range(10))
+    df = bulk.to_dataframe(storage)
+    assert list(df.columns) == list(bulk.FIELDS) and len(df) == 10
+    copy = new_storage(tmp_path / "copy.json")
+    df = pd.concat([df, df.iloc[:2]]) # повторы во входе отклоняются
+    result = bulk.import_dataframe(copy, df, chunk_size=3)
+    assert (result["imported"], result["rejected"]) == (10, 2)
+    assert sorted(copy.scan(), key=lambda record: record["id"]) == sorted(storage.scan(), key=lambda record: record["id"])
+    storage.close()
+    copy.close()
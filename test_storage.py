@@ -0,0 +1,670 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+import backups
+import formats
+from storage import StudentStorage, make_record
+
+
+# Проверки движка без окна: запуск - python -m pytest из папки проекта.
+# Каждая база - во временной папке pytest (tmp_path), фоновое сжатие выключено,
+# если тест не проверяет именно его.
+
+FORMATS = sorted(formats.FORMATS)
+# настройки экземпляров движка в тестах; db_file добавляет к ним режим чтения (use_mmap)
+OPTIONS = {"compact_ratio": None}
+
+
+def student(record_id, name="Иванов Иван", faculty="ФИТ", course=1, gpa=4.0):
+    return make_record(record_id, name, faculty, course, gpa)
+
+
+def new_storage(db_file, record_format="jsonl", **kwargs):
+    storage = StudentStorage(**dict(OPTIONS, **kwargs))
+    storage.create(str(db_file), record_format)
+    return storage
+
+
+def reopen(db_file, **kwargs):
+    storage = StudentStorage(**dict(OPTIONS, **kwargs))
+    storage.open(str(db_file))
+    return storage
+
+
+def ids(records):
+    return sorted(record["id"] for record in records)
+
+
+def same_as_rebuild(storage):
+    # индекс, вторичные индексы и мёртвые байты в памяти - такие же, как после полного прохода по файлу
+    state = (dict(storage.index), storage.dead_bytes, storage.field_indexes, storage.sorted_keys,
+             storage.text_indexes)
+    storage.rebuild_index()
+    return state == (storage.index, storage.dead_bytes, storage.field_indexes, storage.sorted_keys,
+                     storage.text_indexes)
+
+
+@pytest.fixture(params=[(record_format, use_mmap) for record_format in FORMATS for use_mmap in (True, False)],
+                ids=lambda param: param[0] + ("" if param[1] else "-nommap"))
+def db_file(request, tmp_path, monkeypatch):
+    # каждый тест с db_file - для обоих форматов и для чтения и через mmap, и через обычный дескриптор
+    record_format, use_mmap = request.param
+    monkeypatch.setitem(OPTIONS, "use_mmap", use_mmap)
+    return str(tmp_path / ("db.bin" if record_format == "binary" else "db.json")), record_format
+
+
+# --- запись и повторное открытие ---
+
+def test_reopen_after_put_edit_delete(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    for record_id in range(20):
+        storage.put(student(record_id, f"Студент {record_id}", course=record_id % 5 + 1))
+    storage.put(student(3, "Короче", gpa=3.0)) # на месте старой версии
+    storage.put(student(4, "Намного более длинное имя студента", gpa=5.0)) # дописывается в конец
+    storage.delete(5)
+    storage.delete_many([6, 7, 100])
+    storage.close()
+
+    storage = reopen(path)
+    assert storage.count() == 17
+    assert storage.get(3) == student(3, "Короче", gpa=3.0)
+    assert storage.get(4)["name"] == "Намного более длинное имя студента"
+    assert storage.get(5) is None and storage.get(7) is None
+    assert ids(storage.find("faculty", "фит")) == sorted(set(range(20)) - {5, 6, 7})
+    assert same_as_rebuild(storage)
+    storage.close()
+
+
+def test_reopen_uses_saved_index(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(50))
+    storage.close()
+    storage = reopen(path)
+    assert storage.metrics.counters.get("index_rebuilds", 0) == 0
+    assert storage.count() == 50
+    storage.close()
+
+
+def test_edit_in_place_keeps_next_record(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many([student(1, "Длинное имя студента"), student(2)])
+    storage.put(student(1, "Короче")) # на месте, следующая запись не должна пострадать
+    assert storage.get(2) == student(2)
+    assert storage.metrics.counters.get("corrupt_lines", 0) == 0
+    assert same_as_rebuild(storage)
+    storage.compact()
+    assert ids(storage.scan()) == [1, 2]
+    storage.close()
+
+
+@pytest.mark.parametrize("record_format", FORMATS)
+def test_read_raw_is_same_with_and_without_mmap(tmp_path, record_format):
+    path = str(tmp_path / "db")
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id, f"Студент {record_id}") for record_id in range(5))
+    storage.put(student(2, "Коротко")) # на месте старой версии, с заполнителем
+    plain = reopen(path, use_mmap=False)
+    for record_id in range(5):
+        with storage.read_raw(record_id) as mapped, plain.read_raw(record_id) as read:
+            assert bytes(read) == bytes(mapped)
+            assert not bytes(read).endswith(b'\n') or record_format == "binary"
+    plain.close()
+    storage.close()
+
+
+def test_records_appended_without_index_are_picked_up(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put(student(1))
+    storage.close()
+    # как будто программа упала после записи в файл базы, но до записи журнала индекса
+    record_format = formats.detect(path)
+    with open(path, 'ab') as f:
+        f.write(record_format.encode(student(2, "Дописанный")))
+        f.write(record_format.tombstone(1))
+    storage = reopen(path)
+    assert storage.metrics.counters.get("index_rebuilds", 0) == 0
+    assert ids(storage.scan()) == [2]
+    assert same_as_rebuild(storage)
+    storage.close()
+
+
+def torn_write(path, record):
+    # программа упала посреди дописывания записи: в файле осталось начало записи
+    encoded = formats.detect(path).encode(record)
+    with open(path, 'ab') as f:
+        f.write(encoded[:len(encoded) // 2])
+
+
+def test_torn_data_tail_on_open(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put(student(1))
+    storage.close()
+    torn_write(path, student(2, "Оборванная запись"))
+    storage = reopen(path)
+    storage.put(student(3))
+    assert ids(storage.scan()) == [1, 3]
+    assert same_as_rebuild(storage)
+    assert ids(storage.scan()) == [1, 3]
+    storage.compact()
+    storage.close()
+    storage = reopen(path)
+    assert ids(storage.scan()) == [1, 3]
+    storage.close()
+
+
+def test_torn_data_tail_from_other_process(db_file):
+    # обрыв оставил другой экземпляр, пока этот держал базу открытой
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put(student(1))
+    torn_write(path, student(2, "Оборванная запись"))
+    storage.put(student(3))
+    storage.delete(1)
+    assert ids(storage.scan()) == [3]
+    assert same_as_rebuild(storage)
+    storage.compact()
+    assert ids(storage.scan()) == [3]
+    storage.close()
+
+
+def test_torn_tail_before_rebuild(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(3))
+    storage.close()
+    torn_write(path, student(3))
+    for suffix in (".index", ".index.log", ".fields"):
+        os.remove(path + suffix)
+    storage = reopen(path)
+    storage.put(student(4))
+    storage.rebuild_index()
+    assert ids(storage.scan()) == [0, 1, 2, 4]
+    storage.close()
+
+
+def test_torn_index_log_is_cut(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format, checkpoint_min_entries=1000)
+    for record_id in range(5):
+        storage.put(student(record_id))
+    storage.close()
+    with open(path + ".index.log", 'ab') as f:
+        f.write(b'{"id": "9", "offset": 0, "de') # запись в журнал оборвалась
+    storage = reopen(path)
+    assert ids(storage.scan()) == list(range(5))
+    with open(path + ".index.log", 'rb') as f:
+        assert f.read().endswith(b'\n')
+    storage.put(student(9))
+    storage.close()
+    storage = reopen(path)
+    assert ids(storage.scan()) == list(range(5)) + [9]
+    storage.close()
+
+
+def test_rebuild_skips_lines_that_are_not_records(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id) for record_id in range(5))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('123\n["список"]\nне JSON\n')
+    storage.put_many(student(record_id) for record_id in range(5, 10))
+    storage.rebuild_index()
+    assert storage.count() == 10
+    storage.compact()
+    storage.close()
+    storage = reopen(path)
+    assert ids(storage.scan()) == list(range(10))
+    storage.close()
+
+
+def test_index_pointing_past_file_is_rebuilt(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(10))
+    storage.close()
+    with open(path, 'r+b') as f: # файл базы обрезали посреди последней записи, индекс остался прежним
+        f.truncate(os.path.getsize(path) - 10)
+    storage = reopen(path)
+    assert storage.metrics.counters["index_rebuilds"] == 1
+    assert ids(storage.scan()) == list(range(9))
+    storage.close()
+
+
+# --- сжатие ---
+
+def test_compaction_keeps_live_records(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    for record_id in range(30):
+        storage.put(student(record_id))
+    for record_id in range(0, 30, 3):
+        storage.delete(record_id)
+    for record_id in range(1, 30, 3):
+        storage.put(student(record_id, "Новое и заметно более длинное имя"))
+    expected = {record["id"]: record for record in storage.scan()}
+    size_before = os.path.getsize(path)
+    reclaimed = storage.compact()
+    assert reclaimed > 0 and os.path.getsize(path) == size_before - reclaimed
+    assert storage.dead_bytes == 0
+    assert {record["id"]: record for record in storage.scan()} == expected
+    storage.close()
+    storage = reopen(path)
+    assert {record["id"]: record for record in storage.scan()} == expected
+    assert same_as_rebuild(storage)
+    storage.close()
+
+
+def test_dead_bytes_match_file(db_file):
+    # перезаписи на месте то короче, то длиннее, потом дописывание и удаление - заполнители считаются один раз
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id, "Имя средней длины") for record_id in range(10))
+    for name in ["Коротко", "Имя средней", "К", "Имя средней длины", "Я"] * 3:
+        for record_id in range(10):
+            storage.put(student(record_id, name))
+    storage.put(student(1, "Имя, которое уже не помещается на старое место"))
+    storage.delete(2)
+    storage.delete_many([3, 4])
+    assert storage.dead_bytes < os.path.getsize(path)
+    assert same_as_rebuild(storage)
+    storage.close()
+
+
+def test_background_compaction(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path, compact_ratio=0.3, compact_min_bytes=100)
+    storage.put_many(student(record_id) for record_id in range(40))
+    storage.delete_many(range(30))
+    storage.wait_compaction()
+    assert storage.metrics.counters.get("compactions") == 1
+    assert ids(storage.scan()) == list(range(30, 40))
+    storage.close()
+
+
+# --- несколько экземпляров на одном файле ---
+
+def test_two_instances_see_each_other(db_file):
+    path, record_format = db_file
+    first = new_storage(path, record_format)
+    second = reopen(path)
+    first.put(student(1, faculty="Физический"))
+    assert second.get(1)["faculty"] == "Физический"
+    second.put(student(2, faculty="Химический"))
+    second.delete(1)
+    assert first.is_stale()
+    assert ids(first.find("faculty", "Химический")) == [2]
+    assert first.get(1) is None
+    second.compact()
+    assert ids(first.scan()) == [2]
+    first.close()
+    second.close()
+
+
+def _writer(path, base, count):
+    storage = StudentStorage(compact_ratio=0.3, compact_min_bytes=1000, checkpoint_min_entries=50)
+    storage.db_file = path
+    for i in range(count):
+        storage.put(student(base + i, f"Писатель {base}"))
+        if i % 5 == 0:
+            storage.put(student(base + i, f"Писатель {base}, изменённая запись подлиннее"))
+        if i % 7 == 0:
+            storage.delete(base + i)
+    storage.close()
+
+
+def test_processes_write_concurrently(tmp_path):
+    path = str(tmp_path / "db.json")
+    new_storage(path).close()
+    writers = [multiprocessing.Process(target=_writer, args=(path, base * 1000, 150)) for base in range(3)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+    assert all(process.exitcode == 0 for process in writers)
+    storage = reopen(path)
+    assert storage.count() == sum(1 for base in range(3) for i in range(150) if i % 7)
+    assert same_as_rebuild(storage)
+    storage.close()
+
+
+def _read_while_cleared(path, mapped, cleared):
+    storage = reopen(path)
+    raw = storage.read_raw(5) # срез отображения старого файла
+    mapped.set()
+    cleared.wait(10)
+    bytes(raw) # если бы файл обрезали на месте, процесс упал бы здесь с SIGBUS
+
+
+@pytest.mark.parametrize("operation", ["clear", "create"])
+def test_clear_keeps_other_readers_alive(db_file, operation):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(2000))
+    mapped, cleared = multiprocessing.Event(), multiprocessing.Event()
+    reader = multiprocessing.Process(target=_read_while_cleared, args=(path, mapped, cleared))
+    reader.start()
+    assert mapped.wait(10)
+    if operation == "clear":
+        storage.clear()
+    else:
+        storage.create(path, record_format)
+    cleared.set()
+    reader.join()
+    assert reader.exitcode == 0
+    assert storage.count() == 0
+    storage.close()
+
+
+# --- бэкапы ---
+
+def test_backup_restore_chain(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(10))
+    first = storage.backup()
+    storage.put(student(10))
+    second = storage.backup()
+    storage.put(student(11))
+    third = storage.backup()
+    assert (first["type"], second["type"], third["type"]) == ("full", "incremental", "incremental")
+    storage.delete(0)
+    storage.put(student(12))
+
+    directory = backups.backup_dir(path)
+    storage.restore(directory, second["number"])
+    assert ids(storage.scan()) == list(range(11))
+    storage.restore(directory)
+    assert ids(storage.scan()) == list(range(12))
+    assert storage.metrics.counters.get("index_rebuilds", 0) == 1 # только при создании
+    storage.close()
+
+
+def test_backup_after_rewrite_is_full(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id) for record_id in range(10))
+    storage.backup()
+    storage.put(student(3, "Иванов Ив")) # перезапись на месте уже сохранённой части
+    assert storage.backup()["type"] == "full"
+    storage.delete(4)
+    storage.compact()
+    assert storage.backup()["type"] == "full"
+    storage.close()
+
+
+def test_incremental_backup_reads_only_appended(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id) for record_id in range(100))
+    first = storage.backup()
+    storage.put(student(100))
+    read = {}
+
+    def tracking_open(file, mode='r', *args, **kwargs):
+        f = open(file, mode, *args, **kwargs)
+        if 'r' in mode and not str(file).startswith(backups.backup_dir(path)):
+            original_read = f.read
+            read.setdefault(file, 0)
+
+            def counting_read(size=-1):
+                chunk = original_read(size)
+                read[file] += len(chunk)
+                return chunk
+            f.read = counting_read
+        return f
+
+    monkeypatch.setattr(backups, "open", tracking_open, raising=False)
+    second = storage.backup()
+    assert second["type"] == "incremental" and second["start"] == first["end"]
+    assert second["index_type"] == "incremental" and set(second["index"]) == {".index.log"}
+    log_part = second["index"][".index.log"]
+    assert log_part["start"] == first["log_end"] and log_part["end"] == os.path.getsize(path + ".index.log")
+    # из файлов базы прочитано только дописанное после прошлого бэкапа
+    assert read == {path: second["end"] - first["end"], path + ".index.log": log_part["end"] - log_part["start"]}
+    monkeypatch.undo()
+    storage.put(student(101))
+    storage.put(student(101, "Иванов Ив")) # переписана только часть после прошлого бэкапа
+    third = storage.backup()
+    assert third["type"] == "incremental" and third["start"] == second["end"]
+    storage.restore(backups.backup_dir(path))
+    assert storage.get(101)["name"] == "Иванов Ив" and storage.count() == 102
+    storage.close()
+
+
+def test_index_is_chained_between_checkpoints(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format, checkpoint_min_entries=1000)
+    storage.put_many(student(record_id) for record_id in range(10))
+    entries = [storage.backup()]
+    storage.put(student(10))
+    entries.append(storage.backup())
+    storage.delete(0)
+    storage.checkpoint_index() # снимок индекса переписан - он нужен в бэкапе целиком
+    storage.put(student(11))
+    entries.append(storage.backup())
+    storage.put(student(12))
+    entries.append(storage.backup())
+    assert [entry["type"] for entry in entries] == ["full"] + ["incremental"] * 3
+    assert [entry["index_type"] for entry in entries] == ["full", "incremental", "full", "incremental"]
+    assert ".index" not in entries[3]["index"] and ".fields" not in entries[3]["index"]
+
+    directory = backups.backup_dir(path)
+    expected = [list(range(10)), list(range(11)), list(range(1, 12)), list(range(1, 13))]
+    for entry, records in zip(entries, expected):
+        storage.restore(directory, entry["number"])
+        assert ids(storage.scan()) == records
+        assert ids(storage.find("faculty", "фит")) == records
+    assert storage.metrics.counters.get("index_rebuilds", 0) == 1 # только при создании
+    storage.close()
+
+
+def test_backup_after_failed_one_is_full(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id) for record_id in range(10))
+    storage.backup()
+    storage.put(student(3, gpa=3.0)) # отметка о перезаписи обнуляется ещё до копирования
+
+    def failing_copy(*args, **kwargs):
+        raise OSError("нет места на диске")
+
+    monkeypatch.setattr(backups, "_copy_range", failing_copy)
+    with pytest.raises(OSError):
+        storage.backup()
+    monkeypatch.undo()
+    assert not [name for name in os.listdir(backups.backup_dir(path)) if name.startswith("0002.")]
+    entry = storage.backup()
+    assert (entry["number"], entry["type"]) == (2, "full")
+    storage.restore(backups.backup_dir(path))
+    assert storage.get(3)["gpa"] == 3.0
+    storage.close()
+
+
+def test_rewrites_are_seen_by_backup_across_instances(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in range(10))
+    assert storage.backup()["type"] == "full"
+    other = reopen(path)
+    other.put(student(3, gpa=3.0)) # правка на месте в другом экземпляре
+    assert storage.backup()["type"] == "full"
+    other.put(student(10))
+    other.close()
+    storage.close()
+
+    storage = reopen(path) # после полного бэкапа файл только дописывали - и после перезапуска это известно
+    assert storage.backup()["type"] == "incremental"
+    if record_format == "binary":
+        storage.put(student(11, faculty="Новый")) # заголовок с факультетами переписан
+        assert storage.backup()["type"] == "full"
+    storage.restore(backups.backup_dir(path), 1)
+    storage.put(student(12))
+    assert storage.backup()["type"] == "full" # от восстановленного файла цепочку не продолжить
+    storage.close()
+
+
+def test_corrupt_backup_is_rejected(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id) for record_id in range(10))
+    entry = storage.backup(compress=False)
+    part = os.path.join(backups.backup_dir(path), entry["part"])
+    with open(part, 'r+b') as f:
+        f.write(b'X')
+    with pytest.raises(ValueError):
+        storage.restore(backups.backup_dir(path))
+    assert ids(storage.scan()) == list(range(10)) # база не тронута
+    storage.close()
+
+
+# --- форматы ---
+
+def test_convert_round_trip(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    records = [student(1), student(2, "Пётр", "Физический", 3, 4.5),
+               {"id": 3, "name": "Без курса", "faculty": "ФМ"}, student(4, "Очень длинное имя" * 30)]
+    storage.put_many(records)
+    storage.delete(2)
+    storage.put(student(5, faculty="Ф" * 300)) # не помещается в таблицу факультетов - хранится в записи
+    expected = list(storage.scan())
+
+    binary = str(tmp_path / "db.bin")
+    storage.convert(binary)
+    assert formats.detect(binary).name == "binary"
+    assert os.path.getsize(binary) < os.path.getsize(path) + formats.HEADER_SIZE
+    converted = reopen(binary)
+    assert sorted(converted.scan(), key=lambda record: record["id"]) == sorted(expected, key=lambda record: record["id"])
+
+    back = str(tmp_path / "back.json")
+    converted.convert(back)
+    assert formats.detect(back).name == "jsonl"
+    restored = reopen(back)
+    assert sorted(restored.scan(), key=lambda record: record["id"]) == sorted(expected, key=lambda record: record["id"])
+    with pytest.raises(ValueError):
+        storage.convert(path)
+    for opened in (storage, converted, restored):
+        opened.close()
+
+
+def test_binary_faculty_added_by_other_instance(tmp_path):
+    path = str(tmp_path / "db.bin")
+    first = new_storage(path, "binary")
+    second = reopen(path)
+    first.put(student(1, faculty="ФИТ"))
+    second.put(student(2, faculty="Экономический"))
+    first.put(student(3, faculty="Юридический"))
+    assert [record["faculty"] for record in sorted(second.scan(), key=lambda record: record["id"])] == \
+        ["ФИТ", "Экономический", "Юридический"]
+    first.close()
+    second.close()
+
+
+# --- поиск ---
+
+def test_find_range_and_top(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id, course=record_id % 6 + 1, gpa=2.0 + record_id / 10) for record_id in range(30))
+    assert ids(storage.find_range("gpa", 3.0, 3.5)) == list(range(10, 16))
+    assert ids(storage.find_range("gpa", 3.0, 3.5, include_low=False, include_high=False)) == list(range(11, 15))
+    assert ids(storage.find_range("course", high=1)) == list(range(0, 30, 6))
+    assert [record["id"] for record in storage.top("gpa", 3)] == [29, 28, 27]
+    assert [record["id"] for record in storage.top("id", 2, lowest=True)] == [0, 1]
+    storage.put(student(29, gpa=2.0))
+    storage.delete(28)
+    assert [record["id"] for record in storage.top("gpa", 2)] == [27, 26]
+    indexed = storage.find_range("gpa", 2.5, 4.0)
+    storage.close()
+    scanning = reopen(path, field_indexes=False)
+    assert scanning.find_range("gpa", 2.5, 4.0) == indexed
+    scanning.close()
+
+
+def test_page_and_count(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id) for record_id in (17, 3, 250, 42, 8, 99, 1, 64))
+    storage.delete(42)
+    storage.put(student(5))
+    assert storage.count() == 8
+
+    def pages(storage, size):
+        return [[record["id"] for record in storage.page(start, size)] for start in range(0, storage.count() + 1, size)]
+
+    assert pages(storage, 3) == [[1, 3, 5], [8, 17, 64], [99, 250]]
+    assert storage.page(6, 100) == [storage.get(99), storage.get(250)]
+    assert storage.page(8, 3) == []
+    storage.close()
+    scanning = reopen(path, field_indexes=False)
+    assert scanning.count() == 8 and pages(scanning, 3) == [[1, 3, 5], [8, 17, 64], [99, 250]]
+    scanning.close()
+
+
+def test_not_finite_gpa_stays_out_of_ranges(db_file):
+    for gpa in ("nan", "inf", float("-inf")):
+        with pytest.raises(ValueError): # окно добавления, правки и импорт не пропустят
+            student(1, gpa=gpa)
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    storage.put_many(student(record_id, gpa=3.0 + record_id / 10) for record_id in range(6))
+    # записанное мимо make_record (через API или старой версией) не ломает порядок индекса
+    storage.put(dict(student(6), gpa=float("nan")))
+    storage.put(dict(student(7), gpa=float("inf")))
+    assert ids(storage.find_range("gpa", 3.0, 3.5)) == list(range(6))
+    assert [record["id"] for record in storage.top("gpa", 2)] == [5, 4]
+    indexed = storage.find_range("gpa")
+    storage.close()
+    scanning = reopen(path, field_indexes=False)
+    assert scanning.find_range("gpa", 3.0, 3.5) == scanning.find_range("gpa") == indexed
+    scanning.close()
+
+
+def test_search_modes(db_file):
+    path, record_format = db_file
+    storage = new_storage(path, record_format)
+    names = ["Фёдоров Иван", "ФЕДОРОВА Анна", "Петров Федор", "Иванов Пётр", "Фидоров Илья"]
+    storage.put_many(student(record_id, name) for record_id, name in enumerate(names))
+
+    def names_found(text, mode):
+        return [record["name"] for record in storage.search("name", text, mode)]
+
+    assert names_found("ФЕД", "prefix") == ["Фёдоров Иван", "ФЕДОРОВА Анна", "Петров Федор"]
+    assert names_found("дор", "substring") == ["Петров Федор", "Фёдоров Иван", "Фидоров Илья", "ФЕДОРОВА Анна"]
+    assert names_found("фидоров", "fuzzy")[:2] == ["Фидоров Илья", "Фёдоров Иван"]
+    assert ids(storage.find("name", "федоров иван")) == [0]
+    with pytest.raises(ValueError):
+        storage.search("course", "1")
+
+    storage.put(student(0, "Кузнецов Иван"))
+    storage.delete(1)
+    assert names_found("федор", "prefix") == ["Петров Федор"]
+    assert same_as_rebuild(storage)
+    storage.close()
+    scanning = reopen(path, field_indexes=False)
+    assert [record["name"] for record in scanning.search("name", "иван", "substring")] == \
+        ["Иванов Пётр", "Кузнецов Иван"]
+    scanning.close()
+
+
+def test_old_fields_file_is_rebuilt(tmp_path):
+    path = str(tmp_path / "db.json")
+    storage = new_storage(path)
+    storage.put_many(student(record_id, f"Имя {record_id}") for record_id in range(5))
+    storage.close()
+    with open(path + ".fields", 'r', encoding='utf-8') as f:
+        stored = json.load(f)
+    stored["version"] = 1
+    with open(path + ".fields", 'w', encoding='utf-8') as f:
+        json.dump(stored, f)
+    storage = reopen(path)
+    assert ids(storage.search("name", "имя", "prefix")) == list(range(5))
+    storage.close()
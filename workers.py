@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import Cancelled
+
+
+# Долгие операции с базой (открытие с перестройкой индекса, сжатие, поиск, бэкап,
+# импорт) выполняются в пуле рабочих потоков, чтобы окно не замирало.
+# Потоки, а не процессы: индекс и отображение файла живут в памяти этого процесса,
+# а движок сам разводит параллельные чтения и монопольные изменения (ReadWriteLock).
+# Виджеты tkinter трогать можно только из главного потока, поэтому ход работы и
+# результаты забираются оттуда опросом через after().
+
+
+class Task:
+
+    def __init__(self, title, on_done, on_error, on_cancel):
+        self.title = title
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.done = 0 # последнее сообщение о ходе работы (из рабочего потока)
+        self.total = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def progress(self, done, total=None):
+        # вызывается движком из рабочего потока; при отмене прерывает операцию
+        if self._cancel.is_set():
+            raise Cancelled(self.title)
+        self.done, self.total = done, total
+
+
+class TaskRunner:
+
+    def __init__(self, master, max_workers=4, poll_ms=50, on_progress=None):
+        self.master = master
+        self.poll_ms = poll_ms
+        self.on_progress = on_progress # on_progress(задачи) - в главном потоке при каждом опросе
+        self.tasks = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-worker")
+
+    def submit(self, title, function, *args, on_done=None, on_error=None, on_cancel=None, **kwargs):
+        # function(*args, progress=..., **kwargs) выполняется в рабочем потоке
+        task = Task(title, on_done, on_error, on_cancel)
+        task.future = self._executor.submit(function, *args, progress=task.progress, **kwargs)
+        self.tasks.append(task)
+        if len(self.tasks) == 1:
+            self.master.after(self.poll_ms, self._poll)
+        return task
+
+    def cancel_all(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _poll(self):
+        for task in [task for task in self.tasks if task.future.done()]:
+            self.tasks.remove(task)
+            error = task.future.exception()
+            if isinstance(error, Cancelled):
+                if task.on_cancel:
+                    task.on_cancel()
+            elif error is not None:
+                if task.on_error:
+                    task.on_error(error)
+                else:
+                    print(f"Ошибка ({task.title}): {error}")
+            elif task.on_done:
+                task.on_done(task.future.result())
+        if self.on_progress:
+            self.on_progress(self.tasks)
+        if self.tasks:
+            self.master.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=True)
@@ -1,9 +1,31 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
-import pandas as pd
-import json
+from tkinter import simpledialog
 import os
+from storage import RANGE_FIELDS, TEXT_FIELDS, StudentStorage, make_record
+import backups
+import bulk
+import formats
+import metrics
+from workers import TaskRunner
+
+
+PAGE_SIZE = 100 # сколько строк таблицы подгружать за раз (видимые строки + запас)
+WINDOW_PAGES = 3 # больше стольких страниц таблица не держит: при подгрузке дальний край выкидывается
+
+STALE_CHECK_MS = 3000 # как часто проверять, не изменил ли базу другой экземпляр программы
+
+DB_FILETYPES = [("JSON files", "*.json"), ("Двоичная база", "*.bin")]
+
+# поле поиска в окне -> поле записи
+SEARCH_FIELDS = {"ID": "id", "Имя": "name", "Факультет": "faculty", "Курс": "course", "Средний балл": "gpa"}
+
+# условия поиска; сравнения, "между" и "лучшие/худшие N" - только для числовых полей (ID, курс, средний балл)
+SEARCH_CONDITIONS = ["=", ">", ">=", "<", "<=", "между", "лучшие N", "худшие N", "начинается с", "содержит", "похоже на"]
+
+# условия поиска по части имени или факультета -> вид поиска в движке (StudentStorage.search)
+TEXT_CONDITIONS = {"начинается с": "prefix", "содержит": "substring", "похоже на": "fuzzy"}
 
 
 class Database:
@@ -11,9 +33,19 @@ class Database:
     def __init__(self, master):
         self.master = master
         master.title("База данных студентов")
-        self.db_file=None
-        self.index={}
+        self.storage = StudentStorage() # вся работа с файлами - в движке, окно только показывает данные
+        self.snapshot = None # столбцовый снимок для отчётов, создаётся при первом отчёте
+        # долгие операции идут в фоновых потоках, результаты приходят в главный поток через after()
+        self.runner = TaskRunner(master, on_progress=self.show_progress)
+        self.table_version = 0 # растёт при очистке таблицы - запоздавшие страницы не вставляем
+        self.report_pending = False # сводка уже собирается в фоне
+        self.showing_base = False # в таблице записи базы, а не результаты поиска
         self.create_widgets()
+        self.master.after(STALE_CHECK_MS, self.check_stale)
+
+    @property
+    def db_file(self):
+        return self.storage.db_file
 
     def create_widgets(self):
         # Меню (верхнее)
@@ -23,11 +55,19 @@ class Database:
         filemenu.add_command(label="Открыть БД", command=self.open_db)
         filemenu.add_command(label="Удалить БД", command=self.delete_db)
         filemenu.add_command(label="Очистить БД", command=self.clear_db)
+        filemenu.add_command(label="Сжать БД", command=self.compact_db)
         filemenu.add_command(label="Backup БД", command=self.backup_db)
         filemenu.add_command(label="Восстановить из Backup", command=self.restore_db)
+        filemenu.add_command(label="Преобразовать БД", command=self.convert_db)
+        filemenu.add_command(label="Импорт записей", command=self.import_records)
+        filemenu.add_command(label="Экспорт записей", command=self.export_records)
         filemenu.add_separator()
         filemenu.add_command(label="Выход", command=self.master.quit)
         menubar.add_cascade(label="Файл", menu=filemenu)
+        reportmenu = tk.Menu(menubar, tearoff=0)
+        reportmenu.add_command(label="Сводка по базе", command=self.show_report)
+        reportmenu.add_command(label="Статистика движка", command=self.show_metrics)
+        menubar.add_cascade(label="Отчёты", menu=reportmenu)
         self.master.config(menu=menubar)
 
 
@@ -56,188 +96,290 @@ class Database:
         self.tree.heading("Средний балл", text="Средний балл")
         self.tree.grid(row=2, column=0, columnspan=4, padx=5, pady=5)
 
-    def load_index(self):
-        if self.db_file:
-            index_file = self.db_file + ".index" # файл индекса находится рядом с файлом базы
-            try:
-                with open(index_file, 'r') as f:
-                    self.index = json.load(f)
-                    print("Index: ",self.index)
-            except (FileNotFoundError, json.JSONDecodeError):  # если с индексом что-то не так, то мы его переделываем
-                self.rebuild_index()
-
-    def save_index(self):
-        if self.db_file:
-            index_file = self.db_file + ".index"
-            with open(index_file, 'w') as f:
-                json.dump(self.index, f)
-
-    def load_record(self, record_id):
-        if not self.db_file or record_id not in self.index:
-            return None
-        try:
-            with open(self.db_file, 'rb') as f:
-                f.seek(self.index[record_id])
-                line_bytes = f.readline()
-                line = line_bytes.decode('utf-8', errors='ignore').rstrip('\r\n')
-                if line: # если json не пустой
-                    return json.loads(line)
-                return None
-        except (IOError, OSError, json.JSONDecodeError) as e:
-            print(f"Ошибка загрузки {record_id}: {e}")
-            return None
-        
-    def save_record(self, record_id, record_data):
-        self.load_index()
-        if not self.db_file:
+        # База показывается окном из нескольких страниц (по порядку id): у края окна подгружается соседняя
+        # страница, а строки с другого края выкидываются. Ползунок показывает место окна во всей базе -
+        # если перетащить его дальше загруженного, окно загружается заново в том месте
+        self.scrollbar = ttk.Scrollbar(self.master, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.grid(row=2, column=4, sticky="ns", pady=5)
+        self.tree.configure(yscrollcommand=self.on_table_scroll)
+        self.window_start = 0 # позиция в базе первой строки таблицы
+        self.total_rows = 0 # сколько записей в базе
+        self.paging = False # таблица показывает базу окном (результаты поиска - целиком, без подгрузки)
+        self.loading = False # страница уже грузится в фоне
+        self.pending_jump = None # куда перетащили ползунок, пока грузилась страница
+
+        # Строка состояния: ход фоновой операции и её отмена
+        self.status_label = tk.Label(self.master, text="")
+        self.status_label.grid(row=3, column=0, columnspan=2, padx=5, sticky="w")
+        self.progressbar = ttk.Progressbar(self.master, mode="determinate", length=200)
+        self.progressbar.grid(row=3, column=2, padx=5, pady=5)
+        self.cancel_button = ttk.Button(self.master, text="Отмена", command=self.runner.cancel_all, state=tk.DISABLED)
+        self.cancel_button.grid(row=3, column=3, padx=5, pady=5)
+
+    def show_progress(self, tasks):
+        if not tasks:
+            self.status_label.config(text="")
+            self.progressbar.stop()
+            self.progressbar.config(mode="determinate", value=0)
+            self.cancel_button.config(state=tk.DISABLED)
             return
-        if record_id in self.index:
-            self.rebuild_database_file(record_id, record_data)  # передать обновленный и перестроить базу
-        else: # добавляем, если новая запись
-            with open(self.db_file, 'ab') as f: 
-                json_str = json.dumps(record_data, ensure_ascii=False) + '\n'
-                f.write(json_str.encode('utf-8'))
-                self.index[record_id] = f.tell() - len(json_str.encode('utf-8')) # считаем и записываем позицию
-        self.save_index()
-    
-    def rebuild_index(self):
-        self.index = {}
-        if self.db_file and os.path.exists(self.db_file):
-            try:
-                with open(self.db_file, 'rb') as f:
-                    position = 0
-                    while True:
-                        line_bytes = f.readline()
-                        if not line_bytes: 
-                            break 
-                        line = line_bytes.decode('utf-8').rstrip('\r\n') 
-                        try:
-                            record = json.loads(line)
-                            record_id = str(record.get('id'))
-                            if record_id:
-                                self.index[record_id] = position
-                        except json.JSONDecodeError:
-                            print("Пропускаем некорректную JSON запись")
-                        finally:
-                            position += len(line_bytes) # инкремент в байтах независимо от исключения
-            except Exception as e:
-                print(f"Ошибка перестройки индекса: {e}")
-        self.save_index()
+        task = tasks[-1]
+        text = task.title if len(tasks) == 1 else f"{task.title} (и ещё {len(tasks) - 1})"
+        self.status_label.config(text=text + ("..." if not task.cancelled else ": отмена..."))
+        self.cancel_button.config(state=tk.NORMAL)
+        if task.total:
+            self.progressbar.stop()
+            self.progressbar.config(mode="determinate", value=100 * task.done / task.total)
+        elif str(self.progressbar.cget("mode")) != "indeterminate":
+            self.progressbar.config(mode="indeterminate")
+            self.progressbar.start()
 
     def create_db(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        # формат выбирается расширением: .bin - компактный двоичный, иначе JSON lines
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=DB_FILETYPES)
         if file_path:
-            self.db_file = file_path
             self.clear_table()
-            self.index.clear() 
-            # пустой файл
-            with open(self.db_file, 'w') as f:
-                pass
-            self.rebuild_index()
-            self.save_index()
-            print(f"База данных создана: {self.db_file}")
-
-
-    def save_data(self, data_to_save): # используется ли записи пустой информации при очистке базы
-        if self.db_file:
-            with open(self.db_file, 'w') as f:
-                json.dump(data_to_save, f, indent=4)
+            record_format = "binary" if file_path.lower().endswith(".bin") else "jsonl"
+            self.runner.submit("Создание базы", lambda progress: self.storage.create(file_path, record_format),
+                               on_done=lambda result: print(f"База данных создана: {self.db_file}"),
+                               on_error=lambda e: print(f"Ошибка создания базы: {e}"))
 
 
     def open_db(self):
-        file_path = filedialog.askopenfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+        file_path = filedialog.askopenfilename(defaultextension=".json", filetypes=DB_FILETYPES + [("Все файлы", "*")])
         if file_path:
-            self.db_file = file_path
             self.clear_table()
-            self.index.clear()
-            self.rebuild_index()
-            self.load_index() 
-            self.refresh_table()
-            print(f"База данных открыта: {self.db_file}")
+
+            def opened(result):
+                self.refresh_table()
+                print(f"База данных открыта: {self.db_file}")
+
+            def cancelled():
+                self.storage.close()
+                print("Открытие базы отменено.")
+
+            self.runner.submit("Открытие базы", self.storage.open, file_path, on_done=opened, on_cancel=cancelled)
 
 
 
     def delete_db(self):
         if self.db_file:
-            if os.path.exists(self.db_file):
-                os.remove(self.db_file)
-                print(f"База удалена: {self.db_file}")
-                self.db_file = None
-                self.clear_table()
+            db_file = self.db_file
+
+            def dropped(removed):
+                if removed:
+                    print(f"База удалена: {db_file}")
+                    self.clear_table()
+
+            self.runner.submit("Удаление базы", lambda progress: self.storage.drop(), on_done=dropped,
+                               on_error=lambda e: print(f"Ошибка удаления базы: {e}"))
         else:
             print("Не открыт файл базы данных для удаления.")
 
 
     def clear_db(self):
         if self.db_file:
-            self.save_data({})
-            self.refresh_table()
-            print("База данных очищена.")
+            def cleared(result):
+                self.refresh_table()
+                print("База данных очищена.")
+
+            self.clear_table()
+            self.runner.submit("Очистка базы", lambda progress: self.storage.clear(), on_done=cleared,
+                               on_error=lambda e: print(f"Ошибка очистки базы: {e}"))
+
+
+    def compact_db(self):
+        if self.db_file:
+            def compacted(reclaimed):
+                self.refresh_table()
+                print(f"База сжата, освобождено байт: {reclaimed}")
+
+            self.runner.submit("Сжатие базы", self.storage.compact, on_done=compacted)
+        else:
+            print("Не открыта база данных для сжатия.")
 
 
     def backup_db(self):
         if self.db_file:
-            backup_file = self.db_file[:-5] + "_backup.json"
-            try:
-                with open(self.db_file, 'rb') as source_file, open(backup_file, 'wb') as target_file:
-                    target_file.write(source_file.read())        
-                # бэкап индекса
-                index_backup_file = self.db_file[:-5] + "_backup.json.index"
-                try:
-                    with open(self.db_file + ".index", "rb") as index_source, open(index_backup_file, "wb") as index_target:
-                        index_target.write(index_source.read())
-                except Exception as e:
-                    print(f"Ошибка бэкапа индекса: {e}")
-                print(f"Бэкап создан: {backup_file}")
-            except Exception as e:
-                print(f"Ошибка создания бэкапа: {e}")
+            def created(entry):
+                kind = "полный" if entry["type"] == "full" else "инкрементальный"
+                print(f"Бэкап №{entry['number']} создан ({kind}): {backups.backup_dir(self.db_file)}")
+
+            self.runner.submit("Бэкап", self.storage.backup, on_done=created,
+                               on_error=lambda e: print(f"Ошибка создания бэкапа: {e}"))
         else:
             print("Не открыта база данных для бэкапа.")
 
 
     def restore_db(self):
-        file_path = filedialog.askopenfilename(defaultextension=".json", filetypes=[("JSON Files", "*.json")])
+        if not self.db_file:
+            print("Не открыта база данных для восстановления.")
+            return
+        file_path = filedialog.askopenfilename(initialdir=backups.backup_dir(self.db_file),
+                                               filetypes=[("Манифест бэкапов", "manifest.json")])
         if file_path:
-            try:
-                # копируем выбранный json в файл
-                with open(file_path, 'rb') as source_file, open(self.db_file, 'wb') as target_file:
-                    target_file.write(source_file.read())
-                # копируем индекс
-                index_file_path = file_path + ".index"
-                with open(index_file_path, 'rb') as index_source, open(self.db_file + ".index", 'wb') as index_target:
-                    index_target.write(index_source.read())
-                self.rebuild_index()
+            directory = os.path.dirname(file_path)
+            numbers = [entry["number"] for entry in backups.load_manifest(directory)["backups"]]
+            if not numbers:
+                print(f"В {directory} нет бэкапов")
+                return
+            number = simpledialog.askinteger("Восстановление", f"Номер бэкапа ({numbers[0]}-{numbers[-1]}):",
+                                             initialvalue=numbers[-1], parent=self.master)
+            if number is None:
+                return
+            def restored(entry):
+                self.refresh_table()
+                print(f"База восстановлена из бэкапа №{entry['number']} ({entry['created']})")
+
+            def failed(error):
+                if isinstance(error, ValueError):
+                    print(f"Ошибка: {error}")
+                else:
+                    print(f"Ошибка в восстановлении базы: {error}")
+
+            self.clear_table()
+            self.runner.submit("Восстановление", self.storage.restore, directory, number, on_done=restored,
+                               on_error=failed)
+
+
+    def convert_db(self):
+        # копия открытой базы в другом формате (JSON lines <-> двоичный); открытой остаётся старая
+        if not self.db_file:
+            print("Не открыта база данных для преобразования.")
+            return
+        binary = formats.detect(self.db_file).name != "binary"
+        file_path = filedialog.asksaveasfilename(defaultextension=".bin" if binary else ".json", filetypes=DB_FILETYPES)
+        if file_path:
+            if os.path.abspath(file_path) == os.path.abspath(self.db_file):
+                print("Нельзя преобразовать базу в саму себя.")
+                return
+            self.runner.submit("Преобразование базы", self.storage.convert, file_path,
+                               "binary" if binary else "jsonl",
+                               on_done=lambda count: print(f"Записей переписано: {count} в {file_path}"),
+                               on_error=lambda e: print(f"Ошибка преобразования: {e}"))
+
+
+    def import_records(self):
+        if not self.db_file:
+            print("Не открыта база данных для импорта.")
+            return
+        file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv"), ("JSON lines", "*.jsonl *.json")])
+        if file_path:
+            def imported(result):
+                for line_number, error in result["errors"]:
+                    print(f"Строка {line_number}: {error}")
+                print(f"Импортировано записей: {result['imported']}, отклонено: {result['rejected']}")
+                self.refresh_table()
+
+            def cancelled():
+                print("Импорт отменён, уже загруженные записи остались в базе.")
                 self.refresh_table()
-                print(f"База восстановлена из: {file_path}")
-            except FileNotFoundError:
-                print(f"Ошибка: Индекс-файл не найден: {index_file_path}")
-            except (IOError, OSError) as e:
-                print(f"Ошибка в восстановлении базы: {e}")
+
+            self.runner.submit("Импорт", bulk.import_file, self.storage, file_path, on_done=imported,
+                               on_error=lambda e: print(f"Ошибка импорта: {e}"), on_cancel=cancelled)
+
+
+    def export_records(self):
+        if not self.db_file:
+            print("Не открыта база данных для экспорта.")
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv"), ("JSON lines", "*.jsonl")])
+        if file_path:
+            self.runner.submit("Экспорт", bulk.export_file, self.storage, file_path,
+                               on_done=lambda count: print(f"Экспортировано записей: {count} в {file_path}"),
+                               on_error=lambda e: print(f"Ошибка экспорта: {e}"))
+
+
+    def show_report(self):
+        if not self.db_file:
+            print("Не открыта база данных для отчёта.")
+            return
+        try:
+            from analytics import ColumnarSnapshot # нужен numpy, без него остальное окно работает
+        except ImportError as e:
+            print(f"Для отчётов нужен numpy: {e}")
+            return
+        if self.report_pending: # один снимок не обновляют два потока сразу
+            print("Сводка уже готовится.")
+            return
+        if self.snapshot is None or self.snapshot.storage is not self.storage:
+            self.snapshot = ColumnarSnapshot(self.storage)
+        snapshot = self.snapshot
+
+        def build_report(progress):
+            # в рабочем потоке: пока база занята (импорт, сжатие, бэкап), окно не замирает
+            snapshot.refresh() # после первого раза - только изменённые записи
+            lines = [f"Записей: {snapshot.count()}", "", "Средний балл по факультетам:"]
+            for faculty, gpa in sorted(snapshot.mean_gpa_by_faculty().items()):
+                lines.append(f"  {faculty}: {gpa:.2f}")
+            lines += ["", "Средний балл по курсам:"]
+            for course, gpa in snapshot.mean_gpa_by_course().items():
+                lines.append(f"  {course}: {gpa:.2f}")
+            lines += ["", "Студентов по курсам:"]
+            for course, count in snapshot.course_distribution().items():
+                lines.append(f"  {course}: {count}")
+            lines += ["", "Перцентили среднего балла:"]
+            for percentile, gpa in snapshot.gpa_percentiles().items():
+                lines.append(f"  {percentile}%: {gpa:.2f}")
+            return lines
+
+        def built(lines):
+            self.report_pending = False
+            report_window = tk.Toplevel(self.master)
+            report_window.title("Сводка по базе")
+            report_text = tk.Text(report_window, width=50, height=30)
+            report_text.insert(tk.END, "\n".join(lines))
+            report_text.config(state=tk.DISABLED)
+            report_text.grid(row=0, column=0, padx=5, pady=5)
+
+        def failed(error):
+            self.report_pending = False
+            print(f"Ошибка построения сводки: {error}")
+
+        self.report_pending = True
+        self.runner.submit("Сводка по базе", build_report, on_done=built, on_error=failed)
+
+
+    def show_metrics(self):
+        # сколько раз и как долго выполнялись операции движка, сколько записей и байт прочитано
+        metrics_window = tk.Toplevel(self.master)
+        metrics_window.title("Статистика движка")
+        metrics_text = tk.Text(metrics_window, width=80, height=30, font="TkFixedFont")
+        metrics_text.insert(tk.END, self.storage.metrics.report())
+        metrics_text.config(state=tk.DISABLED)
+        metrics_text.grid(row=0, column=0, padx=5, pady=5)
 
 
     def add_record(self):
         def add_to_db():
             try:
-                id_val = str(int(id_entry.get()))
-                name_val = name_entry.get()
-                faculty_val = faculty_entry.get()
-                course_val = int(course_entry.get())
-                gpa_val = float(gpa_entry.get())
-                if self.load_record(id_val): # есть ли уже такой id
-                    error_label.config(text="Ошибка: такой ID уже есть.")
-                    return
-                record_data = {
-                    "id": int(id_val),
-                    "name": name_val,
-                    "faculty": faculty_val,
-                    "course": course_val,
-                    "gpa": gpa_val,
-                }
-                self.save_record(id_val, record_data)
-                self.refresh_table()
-                add_window.destroy()
+                record_data = make_record(id_entry.get(), name_entry.get(), faculty_entry.get(),
+                                          course_entry.get(), gpa_entry.get())
             except ValueError as e:
                 error_label.config(text=f"Error: {e}")
+                return
+
+            def put(progress):
+                # в рабочем потоке: база может быть занята сжатием или импортом
+                if self.storage.get(record_data["id"]): # есть ли уже такой id
+                    return False
+                self.storage.put(record_data)
+                return True
+
+            def added(done):
+                if done:
+                    self.refresh_table()
+                    if add_window.winfo_exists():
+                        add_window.destroy()
+                elif add_window.winfo_exists():
+                    error_label.config(text="Ошибка: такой ID уже есть.")
+
+            def failed(error):
+                if add_window.winfo_exists():
+                    error_label.config(text=f"Ошибка: {error}")
+
+            error_label.config(text="")
+            self.runner.submit("Добавление записи", put, on_done=added, on_error=failed)
 
         # GUI
         add_window = tk.Toplevel(self.master)
@@ -285,86 +427,52 @@ class Database:
         selected_item = self.tree.selection()
         if selected_item:
             item_id = str(self.tree.item(selected_item)['values'][0])
-            self.load_index()
-            if item_id in self.index: 
-                del self.index[item_id]
-                self.save_index()
-                self.rebuild_database_file()
-                self.refresh_table()
-        
-    def rebuild_database_file(self, updated_record_id=None, updated_record_data=None):
-        temp_file = self.db_file + ".temp" # временный файл
-        try:
-            with open(temp_file, 'wb') as temp_f, open(self.db_file, 'rb') as f:
-                for existing_record_id, position in self.index.items():
-                    if updated_record_id and existing_record_id == updated_record_id:
-                        json_str = json.dumps(updated_record_data, ensure_ascii=False) + '\n'
-                        temp_f.write(json_str.encode('utf-8'))
-                    else:
-                        f.seek(position)  # seek читает байт
-                        line_bytes = f.readline()
-                        line = line_bytes.decode('utf-8', errors='ignore').rstrip('\r\n')
-                        try:
-                            record = json.loads(line)
-                            if str(record.get('id')) != existing_record_id:
-                                print(f"Пропускаем несовпавший id записи: Ожидал {existing_record_id}, но получил {record.get('id')}")
-                                continue
-                            json_str = json.dumps(record, ensure_ascii=False) + '\n' 
-                            temp_f.write(json_str.encode('utf-8')) 
-                        except json.JSONDecodeError:
-                            print("Пропускаем некорректную JSON запись")
-        except (IOError, OSError) as e:
-            print(f"Ошибка перестройки файла: {e}")
-            return
-        os.replace(temp_file, self.db_file)  
-        self.rebuild_index()  # перестраиваем индекс, чтобы он совпал
-        self.save_index()
-    
+
+            def deleted(done):
+                if done:
+                    self.refresh_table()
+
+            self.runner.submit("Удаление записи", lambda progress: self.storage.delete(item_id), on_done=deleted,
+                               on_error=lambda e: print(f"Ошибка удаления записи: {e}"))
+
     def search_records(self):
+        # поиск идёт в фоне; окон поиска может быть открыто несколько, и поиски идут одновременно
         def perform_search():
             search_field = field_var.get()
             search_value = value_entry.get()
-            results = []
-            self.load_index() 
-            try:
-                if search_field == "ID":
-                    search_value = str(int(search_value))
-                    if search_value in self.index:
-                        record = self.load_record(search_value)
-                        if record:
-                            results.append(tuple(record.values()))
-                    else:
-                        print(f"Нет записи с ID: {search_value}")
-                elif search_field in ("Курс", "Средний балл"):
-                    search_value = float(search_value) if search_field == "Средний балл" else int(search_value)
-                #  Если не id...
-                if search_field != "ID": 
-                    for record_id in self.index:  
-                        record = self.load_record(record_id)
-                        if record:
-                            if search_field == "Имя":
-                                compare_value = record.get("name", "").lower()
-                                search_value = search_value.lower()
-                            elif search_field == "Факультет":
-                                compare_value = record.get("faculty", "").lower()
-                                search_value = search_value.lower()
-                            elif search_field == "Курс":
-                                compare_value = record.get("course")
-                            elif search_field == "Средний балл":
-                                compare_value = record.get("gpa")
-                            else:
-                                continue 
-                        if compare_value == search_value:
-                            results.append((int(record_id), record.get("name"), record.get("faculty"), record.get("course"), record.get("gpa")))
-            except ValueError:
-                error_label.config(text="Неверный формат ввода для выбранного поля.")
-            except Exception as e:
-                print(f"Ошибка во время поиска: {e}")
-                error_label.config(text="Неожиданная ошибка.")
-            self.clear_table() 
-            for row in results: 
-                self.tree.insert("", tk.END, values=row)
-            search_window.destroy()  # закрыть окно поиска
+            condition = condition_var.get()
+            field = SEARCH_FIELDS.get(search_field)
+            if not field:
+                return
+            if condition in TEXT_CONDITIONS:
+                if field not in TEXT_FIELDS:
+                    error_label.config(text="Это условие - только для имени и факультета.")
+                    return
+            elif condition != "=" and field not in RANGE_FIELDS:
+                error_label.config(text="Это условие - только для ID, курса и среднего балла.")
+                return
+
+            def found(records):
+                if not records and search_field == "ID" and condition == "=":
+                    print(f"Нет записи с ID: {search_value}")
+                self.clear_table()
+                for record in records:
+                    self.tree.insert("", tk.END, values=tuple(record.values()))
+                if search_window.winfo_exists():
+                    search_window.destroy()  # закрыть окно поиска
+
+            def failed(error):
+                if isinstance(error, ValueError):
+                    message = "Неверный формат ввода для выбранного поля."
+                else:
+                    print(f"Ошибка во время поиска: {error}")
+                    message = "Неожиданная ошибка."
+                if search_window.winfo_exists():
+                    error_label.config(text=message)
+
+            error_label.config(text="")
+            self.runner.submit(f"Поиск: {search_field} {condition} {search_value}", self.find_records, field,
+                               condition, search_value, on_done=found, on_error=failed)
 
 
         search_window = tk.Toplevel(self.master)
@@ -378,17 +486,47 @@ class Database:
         field_dropdown = ttk.Combobox(search_window, textvariable=field_var, values=field_options)
         field_dropdown.grid(row=0, column=1)
 
+        condition_label = tk.Label(search_window, text="Условие:")
+        condition_label.grid(row=1, column=0)
+
+        condition_var = tk.StringVar(value="=")
+        condition_dropdown = ttk.Combobox(search_window, textvariable=condition_var, values=SEARCH_CONDITIONS, state="readonly")
+        condition_dropdown.grid(row=1, column=1)
+
         value_label = tk.Label(search_window, text="Значение:")
-        value_label.grid(row=1, column=0)
+        value_label.grid(row=2, column=0)
 
         value_entry = tk.Entry(search_window)
-        value_entry.grid(row=1, column=1)
+        value_entry.grid(row=2, column=1)
+
+        hint_label = tk.Label(search_window, text="\"между\": два числа через пробел, \"лучшие N\": число записей,\n"
+                                                  "\"похоже на\": имя или факультет с опечатками")
+        hint_label.grid(row=3, column=0, columnspan=2)
 
         error_label = tk.Label(search_window, text="", fg="red")
-        error_label.grid(row=2, column=0, columnspan=2)
+        error_label.grid(row=4, column=0, columnspan=2)
 
         search_button = ttk.Button(search_window, text="Найти", command=perform_search)
-        search_button.grid(row=3, column=0, columnspan=2)
+        search_button.grid(row=5, column=0, columnspan=2)
+
+    def find_records(self, field, condition, value, progress=None):
+        # перевод условия из окна поиска в запрос к движку; ValueError - если значение не разобрать
+        if condition == "=":
+            return self.storage.find(field, value, progress=progress)
+        if condition in TEXT_CONDITIONS:
+            return self.storage.search(field, value, TEXT_CONDITIONS[condition], progress=progress)
+        if condition in ("лучшие N", "худшие N"):
+            return self.storage.top(field, int(value), lowest=condition == "худшие N", progress=progress)
+        if condition == "между":
+            low, high = value.replace(";", " ").split()
+            return self.storage.find_range(field, low, high, progress=progress)
+        bounds = {
+            ">": dict(low=value, include_low=False),
+            ">=": dict(low=value),
+            "<": dict(high=value, include_high=False),
+            "<=": dict(high=value),
+        }
+        return self.storage.find_range(field, progress=progress, **bounds[condition])
 
     def edit_record(self):
         selected_item = self.tree.selection()
@@ -396,28 +534,44 @@ class Database:
             item_data = self.tree.item(selected_item)['values']
             item_id = str(item_data[0]) 
             def update_record():
-                record = self.load_record(item_id)
-                if not record: 
-                    error_label.config(text=f"Ошибка: запись с ID {item_id} не найдена.")
-                    return
                 try:
-                    new_name = name_entry.get()
-                    new_faculty = faculty_entry.get()
-                    new_course = int(course_entry.get())
-                    new_gpa = float(gpa_entry.get())
-                    if not new_name:
+                    # те же проверки, что при добавлении и импорте (средний балл - конечное число)
+                    new_record = make_record(item_id, name_entry.get(), faculty_entry.get(), course_entry.get(),
+                                             gpa_entry.get())
+                    if not new_record["name"]:
                         raise ValueError("Имя не может быть пустым.")
-                    record.update({  
-                        "name": new_name,
-                        "faculty": new_faculty,
-                        "course": new_course,
-                        "gpa": new_gpa,
-                    })
-                    self.save_record(item_id, record)
-                    self.refresh_table()
-                    edit_window.destroy()
                 except ValueError as e:
                     error_label.config(text=f"Ошибка: {e}")
+                    return
+
+                def put(progress):
+                    # в рабочем потоке: база может быть занята сжатием или импортом
+                    record = self.storage.get(item_id)
+                    if not record:
+                        return False
+                    record.update({
+                        "name": new_record["name"],
+                        "faculty": new_record["faculty"],
+                        "course": new_record["course"],
+                        "gpa": new_record["gpa"],
+                    })
+                    self.storage.put(record)
+                    return True
+
+                def updated(done):
+                    if done:
+                        self.refresh_table()
+                        if edit_window.winfo_exists():
+                            edit_window.destroy()
+                    elif edit_window.winfo_exists():
+                        error_label.config(text=f"Ошибка: запись с ID {item_id} не найдена.")
+
+                def failed(error):
+                    if edit_window.winfo_exists():
+                        error_label.config(text=f"Ошибка: {error}")
+
+                error_label.config(text="")
+                self.runner.submit("Изменение записи", put, on_done=updated, on_error=failed)
 
             edit_window = tk.Toplevel(self.master)
             edit_window.title("Редактировать запись")
@@ -455,28 +609,156 @@ class Database:
             update_button = ttk.Button(edit_window, text="Обновить", command=update_record)
             update_button.grid(row=5, column=0, columnspan=2)
 
+    def check_stale(self):
+        # с той же базой могут работать несколько операторов - чужие изменения подтягиваем в таблицу
+        if self.db_file and self.showing_base and not self.runner.tasks and self.storage.is_stale():
+            print("База изменена другим пользователем.")
+            self.refresh_table()
+        self.master.after(STALE_CHECK_MS, self.check_stale)
+
     def refresh_table(self):
-        self.clear_table()  
+        # окно перечитывается на том же месте - после правки записи таблица не прыгает в начало
+        start = self.top_row() if self.showing_base and self.paging else 0
+        self.clear_table()
         if self.db_file:
-            self.load_index()
-            display_data = [] # список только для хранения данных на вывод пользователю!
-            for record_id in self.index:
-                record = self.load_record(record_id)
-                print("Запись: ",record)
-                if record:
-                    display_data.append(tuple(record.values())) # добавляем записи в массив
-            print("Данные: ",display_data)
-            for row in display_data:
-                self.tree.insert("", tk.END, values=row)
-            display_data.clear()
-            print("Таблица обновлена.")
+            self.showing_base = True
+            self.load_window(start, on_loaded=lambda: print("Таблица обновлена."))
         else:
             print("Нет базы или некорректный файл.")
 
-    def clear_table(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+    def load_window(self, row, on_loaded=None):
+        # окно вокруг позиции row загружается в рабочем потоке и заменяет всё, что было в таблице
+        version = self.table_version
+        self.loading = True
+
+        def load(progress):
+            total = self.storage.count()
+            start = max(0, min(row - PAGE_SIZE, total - PAGE_SIZE * WINDOW_PAGES))
+            return total, start, self.storage.page(start, PAGE_SIZE * WINDOW_PAGES)
+
+        def loaded(result):
+            if version != self.table_version: # таблицу успели очистить (другой поиск, другая база)
+                return
+            self.total_rows, self.window_start, records = result
+            self.tree.delete(*self.tree.get_children())
+            self.insert_rows(records)
+            self.paging = True
+            self.show_row(row)
+            self.page_loaded()
+            if on_loaded:
+                on_loaded()
+
+        self.submit_page(load, loaded)
+
+    def load_page(self, forward):
+        # соседняя с окном страница (forward - следующая, иначе предыдущая) в рабочем потоке
+        version = self.table_version
+        rows = len(self.tree.get_children())
+        start = self.window_start + rows if forward else max(0, self.window_start - PAGE_SIZE)
+        count = PAGE_SIZE if forward else self.window_start - start
+        self.loading = True
+
+        def loaded(result):
+            if version != self.table_version:
+                return
+            self.total_rows, records = result
+            self.add_page(records, forward)
+            self.page_loaded()
+
+        self.submit_page(lambda progress: (self.storage.count(), self.storage.page(start, count)), loaded)
+
+    def submit_page(self, load, loaded):
+        def stopped(*args):
+            self.loading = False
+
+        self.runner.submit("Загрузка таблицы", load, on_done=loaded, on_error=stopped, on_cancel=stopped)
+
+    def page_loaded(self):
+        self.loading = False
+        if self.pending_jump is not None: # ползунок перетащили, пока грузилась страница
+            row, self.pending_jump = self.pending_jump, None
+            self.jump_to(row)
+
+    def insert_rows(self, records, index=tk.END):
+        for record in records:
+            self.tree.insert("", index, values=tuple(record.values()))
+            if index != tk.END:
+                index += 1
+
+    def add_page(self, records, forward):
+        # страница у края окна; строки с противоположного края сверх WINDOW_PAGES страниц выкидываются,
+        # а вид сдвигается так, чтобы на экране остались те же строки
+        top = self.top_row()
+        if forward:
+            self.insert_rows(records)
+        else:
+            self.insert_rows(records, 0)
+            self.window_start -= len(records)
+        items = self.tree.get_children()
+        extra = len(items) - PAGE_SIZE * WINDOW_PAGES
+        if extra > 0:
+            if forward:
+                self.tree.delete(*items[:extra])
+                self.window_start += extra
+            else:
+                self.tree.delete(*items[-extra:])
+        self.show_row(top)
+
+    def top_row(self):
+        # позиция в базе первой видимой строки
+        rows = len(self.tree.get_children())
+        return self.window_start + round(self.tree.yview()[0] * rows)
+
+    def show_row(self, row):
+        rows = len(self.tree.get_children())
+        if rows:
+            self.tree.yview_moveto((row - self.window_start) / rows)
+
+    def jump_to(self, row):
+        row = max(0, min(row, self.total_rows - 1))
+        rows = len(self.tree.get_children())
+        if self.window_start <= row < self.window_start + rows:
+            self.show_row(row)
+        elif self.loading:
+            self.pending_jump = row
+        else:
+            self.load_window(row)
+
+    def on_scrollbar(self, *args):
+        # перетаскивание ползунка (moveto) - в позицию по всей базе, остальное (стрелки, страницы) - как обычно
+        if self.paging and args[0] == "moveto" and self.total_rows:
+            self.jump_to(int(float(args[1]) * self.total_rows))
+        else:
+            self.tree.yview(*args)
 
-root = tk.Tk()
-db = Database(root)
-root.mainloop()
\ No newline at end of file
+    def on_table_scroll(self, first, last):
+        if not self.paging or not self.total_rows:
+            self.scrollbar.set(first, last)
+            return
+        # ползунок - по всей базе, а не по загруженным строкам
+        rows = len(self.tree.get_children())
+        self.scrollbar.set((self.window_start + float(first) * rows) / self.total_rows,
+                           (self.window_start + float(last) * rows) / self.total_rows)
+        if self.loading:
+            return
+        if float(last) > 0.9 and self.window_start + rows < self.total_rows:
+            self.load_page(forward=True)
+        elif float(first) < 0.1 and self.window_start > 0:
+            self.load_page(forward=False)
+
+    def clear_table(self):
+        self.tree.delete(*self.tree.get_children())
+        self.window_start = 0
+        self.total_rows = 0
+        self.paging = False
+        self.loading = False
+        self.pending_jump = None
+        self.showing_base = False
+        self.table_version += 1
+
+if __name__ == "__main__":
+    metrics.configure_logging() # сообщения движка - в консоль; STUDENTS_DEBUG=1 - подробно
+    root = tk.Tk()
+    db = Database(root)
+    root.mainloop()
+    db.runner.shutdown()
\ No newline at end of file